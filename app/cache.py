@@ -0,0 +1,225 @@
+import json
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+MISSING = object()
+
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", 2048))
+CACHE_TTL = {
+    "skills": float(os.getenv("CACHE_TTL_SKILLS", 600)),
+    "np": float(os.getenv("CACHE_TTL_NP", 600)),
+    "servant_list": float(os.getenv("CACHE_TTL_SERVANT_LIST", 60)),
+    "localization": float(os.getenv("CACHE_TTL_LOCALIZATION", 600)),
+    "image_path": float(os.getenv("CACHE_TTL_IMAGE_PATH", 3600)),
+}
+DEFAULT_TTL = float(os.getenv("CACHE_TTL_DEFAULT", 60))
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "/tmp/fgp-cache.sqlite3")
+# seconds between reads of the shared invalidation log; 0 reads it on every
+# cache access, which is a blocking query on the event loop
+CACHE_SYNC_INTERVAL = float(os.getenv("CACHE_SYNC_INTERVAL", 1))
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    def get(self, key: tuple):
+        ...
+
+    @abstractmethod
+    def set(self, key: tuple, value):
+        ...
+
+    @abstractmethod
+    def generation(self, entity: str) -> int:
+        ...
+
+    @abstractmethod
+    def invalidate(self, *prefix):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+    async def get_or_load(self, key: tuple, loader):
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+        # a write that lands while the loader awaits bumps the generation,
+        # and the possibly stale result is then returned but not stored
+        generation = self.generation(key[0])
+        value = await loader()
+        if self.generation(key[0]) == generation:
+            self.set(key, value)
+        return value
+
+
+class MemoryBackend(CacheBackend):
+    # Keys are tuples whose first element names the entity, e.g.
+    # ("localization", servant_id, language); the entity picks the TTL and
+    # is the unit that hit/miss counters and invalidations work on.
+    def __init__(self, maxsize: int, ttl: dict[str, float], default_ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.default_ttl = default_ttl
+        self._data: OrderedDict[tuple, tuple[float, object]] = OrderedDict()
+        self._generations: dict[str, int] = {}
+        self._hits: dict[str, int] = {}
+        self._misses: dict[str, int] = {}
+        self.evictions = 0
+
+    def get(self, key: tuple):
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self._hits[key[0]] = self._hits.get(key[0], 0) + 1
+                return value
+            del self._data[key]
+        self._misses[key[0]] = self._misses.get(key[0], 0) + 1
+        return MISSING
+
+    def set(self, key: tuple, value):
+        ttl = self.ttl.get(key[0], self.default_ttl)
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def generation(self, entity: str) -> int:
+        return self._generations.get(entity, 0)
+
+    def invalidate(self, *prefix):
+        entity = prefix[0]
+        self._generations[entity] = self.generation(entity) + 1
+        for key in [key for key in self._data if key[: len(prefix)] == prefix]:
+            del self._data[key]
+
+    def clear(self):
+        for entity in {key[0] for key in self._data}:
+            self._generations[entity] = self.generation(entity) + 1
+        self._data.clear()
+
+    def stats(self) -> dict:
+        entities = set(self._hits) | set(self._misses) | set(self.ttl)
+        return {
+            "backend": "memory",
+            "size": len(self._data),
+            "max_size": self.maxsize,
+            "evictions": self.evictions,
+            "entities": {
+                entity: {
+                    "hits": self._hits.get(entity, 0),
+                    "misses": self._misses.get(entity, 0),
+                    "ttl": self.ttl.get(entity, self.default_ttl),
+                }
+                for entity in sorted(entities)
+            },
+        }
+
+
+class SQLiteBackend(CacheBackend):
+    # Values stay in the worker's own MemoryBackend; only invalidations are
+    # shared. Every worker appends them to a log table in one SQLite file on
+    # the host and replays the entries it has not seen before serving a read,
+    # at most once per sync_interval, so another worker's write can be
+    # served stale for up to that long.
+    KEEP_EVENTS = 10000
+
+    def __init__(self, path: str, local: MemoryBackend, sync_interval: float = 1):
+        self.path = path
+        self.local = local
+        self.sync_interval = sync_interval
+        self.conn = sqlite3.connect(
+            path, timeout=5, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS invalidation ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, prefix TEXT NOT NULL)"
+        )
+        self._last_id = self._max_id()
+        self._synced_at = time.monotonic()
+        self.published = 0
+        self.applied = 0
+
+    def _max_id(self) -> int:
+        row = self.conn.execute("SELECT MAX(id) FROM invalidation").fetchone()
+        return row[0] or 0
+
+    def sync(self):
+        now = time.monotonic()
+        if self.sync_interval and now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        rows = self.conn.execute(
+            "SELECT id, prefix FROM invalidation WHERE id > ? ORDER BY id",
+            (self._last_id,),
+        ).fetchall()
+        if rows and rows[0][0] != self._last_id + 1:
+            # the entries we missed were pruned, so drop everything
+            self.local.clear()
+        for event_id, prefix in rows:
+            self.local.invalidate(*json.loads(prefix))
+            self._last_id = event_id
+            self.applied += 1
+
+    def get(self, key: tuple):
+        self.sync()
+        return self.local.get(key)
+
+    def set(self, key: tuple, value):
+        self.local.set(key, value)
+
+    def generation(self, entity: str) -> int:
+        self.sync()
+        return self.local.generation(entity)
+
+    def invalidate(self, *prefix):
+        self.sync()
+        self.local.invalidate(*prefix)
+        cursor = self.conn.execute(
+            "INSERT INTO invalidation (prefix) VALUES (?)", (json.dumps(prefix),)
+        )
+        event_id = cursor.lastrowid
+        if event_id == self._last_id + 1:
+            self._last_id = event_id
+        self.published += 1
+        if event_id % 1000 == 0:
+            self.conn.execute(
+                "DELETE FROM invalidation WHERE id <= ?",
+                (event_id - self.KEEP_EVENTS,),
+            )
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self) -> dict:
+        return {
+            **self.local.stats(),
+            "backend": "sqlite",
+            "path": self.path,
+            "published": self.published,
+            "applied": self.applied,
+        }
+
+
+def create_cache(backend: str = CACHE_BACKEND) -> CacheBackend:
+    local = MemoryBackend(CACHE_MAX_SIZE, CACHE_TTL, DEFAULT_TTL)
+    if backend == "memory":
+        return local
+    if backend == "sqlite":
+        return SQLiteBackend(CACHE_SQLITE_PATH, local, CACHE_SYNC_INTERVAL)
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+catalog_cache = create_cache()
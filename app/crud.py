@@ -1,23 +1,98 @@
-from sqlalchemy import and_, func
+from datetime import datetime
+
+from sqlalchemy import (
+    Integer,
+    and_,
+    any_,
+    bindparam,
+    delete,
+    func,
+    insert,
+    literal_column,
+    null,
+    or_,
+    text,
+    tuple_,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 from sqlalchemy.future import select
 from sqlalchemy.orm import (
     Session,
     aliased,
+    contains_eager,
     selectinload,
     load_only,
     joinedload,
+    noload,
     subqueryload,
 )
-from sqlalchemy.exc import IntegrityError, DataError, InternalError
+from sqlalchemy.exc import IntegrityError, DataError, DBAPIError
+from pydantic import ValidationError
+import orjson
 from sqlalchemy.ext.asyncio import AsyncSession
-from psycopg2.errors import (
-    CheckViolation,
-    UniqueViolation,
-    RaiseException,
-    ForeignKeyViolation,
-)
+from psycopg2.errors import CheckViolation, UniqueViolation
 from .models import *
 from .schemas import *
+from .cache import catalog_cache
+from .database import use_primary
+from .media import image_info, public_url, schedule_derivatives
+from starlette.concurrency import run_in_threadpool
+from .utils import (
+    DEFAULT_PAGE_SIZE,
+    SYNC_PAGE_SIZE,
+    LocalizationProjection,
+    cursor_values,
+    decode_cursor,
+    encode_cursor,
+)
+
+
+def localization_loader(projection: LocalizationProjection | None, loader=selectinload):
+    # the language filter goes into the loader's own query, and load_only
+    # keeps unrequested Text columns out of the SELECT
+    if projection is None:
+        return loader(Servant.localizations)
+    relationship = Servant.localizations
+    if projection.languages:
+        relationship = relationship.and_(
+            ServantLocalization.language.in_(projection.languages)
+        )
+    return loader(relationship).load_only(
+        ServantLocalization.servant_id,
+        ServantLocalization.language,
+        *(getattr(ServantLocalization, field) for field in projection.fields),
+    )
+
+
+def project(schema, localization_schema, servant, projection):
+    # validates a servant loaded with localization_loader(projection); with
+    # languages, only the best ranked one it has is kept. Fields outside the
+    # mask stay unset, so routes with response_model_exclude_unset omit them.
+    if projection is None:
+        return schema.model_validate(servant)
+    localizations = servant.localizations
+    if projection.languages:
+        rank = {language: index for index, language in enumerate(projection.languages)}
+        localizations = sorted(localizations, key=lambda l: rank[l.language])[:1]
+    loaded = {"id", "servant_id", "language", *projection.fields}
+    data = {
+        field: getattr(servant, field)
+        for field in schema.model_fields
+        if field != "localizations"
+    }
+    data["localizations"] = [
+        localization_schema.model_validate(
+            {
+                field: getattr(localization, field)
+                for field in localization_schema.model_fields
+                if field in loaded
+            }
+        )
+        for localization in localizations
+    ]
+    return schema.model_validate(data, from_attributes=True)
 
 
 class ServantService:
@@ -33,39 +108,147 @@ class ServantService:
         servant = await self.db.execute(query)
         return servant.scalars().first()
 
-    async def get_all(self) -> List[Servant]:
-        query = select(Servant)
+    async def get_all(
+        self,
+        filters: ServantFilter | None = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+    ) -> ServantPage:
+        query = self._page_query(select(Servant), filters, limit, cursor)
         servants = (await self.db.execute(query)).scalars().all()
-        return servants
+        next_cursor = None
+        if len(servants) > limit:
+            servants = servants[:limit]
+            next_cursor = encode_cursor({"id": servants[-1].id})
+        return ServantPage(
+            items=list(map(ServantResponse.model_validate, servants)),
+            next_cursor=next_cursor,
+        )
+
+    @staticmethod
+    def _page_query(query, filters: ServantFilter | None, limit: int, cursor):
+        query = query.order_by(Servant.id).limit(limit + 1)
+        if cursor:
+            (last_id,) = cursor_values(cursor, "id")
+            query = query.where(Servant.id > last_id)
+        if filters:
+            if filters.class_name:
+                query = query.where(Servant.class_name == filters.class_name)
+            if filters.gender:
+                query = query.where(Servant.gender == filters.gender)
+            if filters.alignment:
+                query = query.where(Servant.alignment == filters.alignment)
+            if filters.state:
+                query = query.where(Servant.state == filters.state)
+            if filters.min_level is not None:
+                query = query.where(Servant.level >= filters.min_level)
+            if filters.max_level is not None:
+                query = query.where(Servant.level <= filters.max_level)
+        return query
+
+    async def get_servant_list(
+        self, projection: LocalizationProjection | None = None
+    ) -> List[ServantWithLocalization]:
+        key = ("servant_list",) if projection is None else ("servant_list", *projection)
+        return await catalog_cache.get_or_load(
+            key, lambda: self._load_servant_list(projection)
+        )
 
-    async def get_servant_list(self) -> List[ServantWithLocalization]:
+    async def _load_servant_list(
+        self, projection: LocalizationProjection | None
+    ) -> List[ServantWithLocalization]:
+        use_primary(self.db)
         query = (
             select(Servant)
-            .options(subqueryload(Servant.localizations))
+            .options(localization_loader(projection, subqueryload))
             .order_by(Servant.id)
         )
         servants = (await self.db.execute(query)).scalars().all()
-        return list(map(ServantWithLocalization.model_validate, servants))
+        return [
+            project(ServantWithLocalization, LocalizationResponse, servant, projection)
+            for servant in servants
+        ]
+
+    async def get_detail(
+        self, id: int, projection: LocalizationProjection | None = None
+    ) -> ServantDetail | None:
+        query = (
+            select(Servant)
+            .options(localization_loader(projection))
+            .where(Servant.id == id)
+        )
+        servant = (await self.db.execute(query)).scalars().first()
+        if servant is None:
+            return None
+        return project(ServantDetail, LocalizationRecord, servant, projection)
 
     async def get_details(self, id: int):
         servant = await self.get(id)
-        localizations: List[ServantLocalization] = await self.get_localizaion(
-            servant.id
-        )
-        return {localization.language: localization for localization in localizations}
+        return {
+            localization.language: localization
+            for localization in servant.localizations
+        }
 
     async def get_name(self, servant_id, language):
         localization = await self.get_localizaion(servant_id, language)
-        if type(localization) is ServantLocalization:
+        if isinstance(localization, LocalizationResponse):
             return localization.name
         return "none"
 
-    def get_aliases():
-        pass
+    async def export(self, chunk_size: int = 500):
+        # yield_per keeps one chunk of servants (plus its selectin loads) in
+        # memory at a time; the identity map only holds them weakly, so a
+        # chunk is freed once its schemas have been written out
+        query = (
+            select(Servant)
+            .options(
+                selectinload(Servant.localizations),
+                selectinload(Servant.noble_phantasm),
+                selectinload(Servant.skills).joinedload(ServantSkill.skill),
+            )
+            .order_by(Servant.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        result = await self.db.stream(query)
+        async for servants in result.scalars().partitions():
+            yield list(map(ServantExport.model_validate, servants))
 
-    def get_full_servant(self, id: int):
-        servant = self.get(id)
-        localizations = self.get_details(id)
+    async def get_aliases(
+        self, servant_id: int, language: str | None = None
+    ) -> List[AliasResponse]:
+        query = select(Alias).where(Alias.servant_id == servant_id).order_by(Alias.id)
+        if language:
+            query = query.where(Alias.language_code == language)
+        aliases = (await self.db.execute(query)).scalars().all()
+        return list(map(AliasResponse.model_validate, aliases))
+
+    async def get_full_servant(
+        self, id: int, projection: LocalizationProjection | None = None
+    ) -> FullServantResponse | None:
+        query = (
+            select(Servant)
+            .options(
+                localization_loader(projection),
+                selectinload(Servant.noble_phantasm),
+                selectinload(Servant.skills).joinedload(ServantSkill.skill),
+                selectinload(Servant.aliases),
+                selectinload(Servant.pictures),
+            )
+            .where(Servant.id == id)
+        )
+        servant = (await self.db.execute(query)).scalars().first()
+        if not servant:
+            return None
+        return project(FullServantResponse, LocalizationResponse, servant, projection)
+
+    @staticmethod
+    def pick_localization(localizations, language: str):
+        for localization in localizations:
+            if localization.language == language:
+                return localization
+        if localizations:
+            return localizations[0]
+        return None
 
     async def add_localization(
         self,
@@ -94,6 +277,8 @@ class ServantService:
         s = await self.get(servant_id)
         s.localizations.append(details)
         await self.db.commit()
+        catalog_cache.invalidate("localization", int(servant_id))
+        catalog_cache.invalidate("servant_list")
 
     async def update_localization(
         self, language: str, servant_id: str, localization: LocalizationResponse
@@ -129,20 +314,36 @@ class ServantService:
             details.servant_id = servant_id
             self.db.add(details)
         await self.db.commit()
+        catalog_cache.invalidate("localization", int(servant_id))
+        catalog_cache.invalidate("servant_list")
 
     async def get_localizaion(self, servant_id: int, language: str):
+        localization = await catalog_cache.get_or_load(
+            ("localization", int(servant_id), language),
+            lambda: self._load_localization(servant_id, language),
+        )
+        if localization is None:
+            return {"this servant has no info"}
+        return localization
+
+    async def _load_localization(
+        self, servant_id: int, language: str
+    ) -> LocalizationResponse | None:
+        use_primary(self.db)
         servant = await self.get(servant_id)
-        for localization in servant.localizations:
-            if localization.language == language:
-                return localization
-        if servant.localizations:
-            return servant.localizations[0]
-        return {"this servant has no info"}
+        localization = self.pick_localization(servant.localizations, language)
+        if localization is None:
+            return None
+        return LocalizationResponse.model_validate(localization)
+
+    async def get_all_np(self) -> List[NoblePhantasmResponse]:
+        return await catalog_cache.get_or_load(("np",), self._load_all_np)
 
-    async def get_all_np(self):
+    async def _load_all_np(self) -> List[NoblePhantasmResponse]:
+        use_primary(self.db)
         query = select(NoblePhantasm)
         np_list = (await self.db.execute(query)).scalars().all()
-        return np_list
+        return list(map(NoblePhantasmResponse.model_validate, np_list))
 
     async def get_np(self, id: int) -> NoblePhantasm:
         query = select(NoblePhantasm).where(NoblePhantasm.servant_id == id)
@@ -155,6 +356,7 @@ class ServantService:
         updated_np.name = np.name
         updated_np.rank = np.rank
         await self.db.commit()
+        catalog_cache.invalidate("np")
 
     async def create_np(self, np: NoblePhantasmUpdate):
         new_np = NoblePhantasm(
@@ -166,11 +368,13 @@ class ServantService:
         )
         self.db.add(new_np)
         await self.db.commit()
+        catalog_cache.invalidate("np")
 
     async def delete_np(self, id):
         np = await self.get_np(id)
         await self.db.delete(np)
         await self.db.commit()
+        catalog_cache.invalidate("np")
 
     async def update_skill(self, skill: SkillSchema):
         query = select(Skill).where(Skill.id == skill.id)
@@ -180,6 +384,7 @@ class ServantService:
         updated_skill.rank = skill.rank
         updated_skill.skill_type = skill.skill_type
         await self.db.commit()
+        catalog_cache.invalidate("skills")
 
     async def create_skill(self, skill: SkillSchema):
         new_skill = Skill(
@@ -190,6 +395,7 @@ class ServantService:
         )
         self.db.add(new_skill)
         await self.db.commit()
+        catalog_cache.invalidate("skills")
 
     async def create(self, servant: ServantCreate) -> Servant:
         servant = Servant(
@@ -200,7 +406,9 @@ class ServantService:
         )
         try:
             self.db.add(servant)
+            await AnalyticsService(self.db).refresh_class_levels(servant.class_name)
             await self.db.commit()
+            catalog_cache.invalidate("servant_list")
             await self.db.refresh(servant)
             return servant
         except IntegrityError as e:
@@ -212,6 +420,7 @@ class ServantService:
 
     async def update(self, id: int, s: ServantUpdate):
         servant = await self.get(id)
+        old_class_name = servant.class_name
         if s.name:
             servant.name = s.name
         if s.class_name:
@@ -225,7 +434,12 @@ class ServantService:
         if s.gender:
             servant.gender = s.gender
         try:
+            if s.class_name or s.level:
+                await AnalyticsService(self.db).refresh_for_servant(
+                    servant.id, old_class_name, servant.class_name
+                )
             await self.db.commit()
+            catalog_cache.invalidate("servant_list")
             await self.db.refresh(servant)
             return servant
         except IntegrityError as e:
@@ -238,86 +452,191 @@ class ServantService:
     async def delete(self, id: int):
         servant = await self.get(id)
         if servant:
+            analytics = AnalyticsService(self.db)
+            master_ids = await analytics.masters_of(servant.id)
             await self.db.delete(servant)
+            await self.db.flush()
+            await analytics.refresh_class_levels(servant.class_name)
+            await analytics.refresh_top_servants(*master_ids)
             await self.db.commit()
+            catalog_cache.invalidate("servant_list")
+            catalog_cache.invalidate("localization", id)
+            catalog_cache.invalidate("np")
+            catalog_cache.invalidate("image_path", "picture", id)
         else:
             raise ValueError("Servant does not exist")
 
-    def get_localizaions(self):
-        return (
-            self.db.query(
+    async def get_localizaions(self):
+        query = (
+            select(
                 Servant.name,
                 ServantLocalization.language,
                 ServantLocalization.name,
                 ServantLocalization.description,
             )
             .join(ServantLocalization)
-            .filter(ServantLocalization.language.in_(["ru", "en"]))
-            .all()
+            .where(ServantLocalization.language.in_(["ru", "en"]))
         )
+        return (await self.db.execute(query)).all()
 
-    async def get_skills(self, id: int):
-        servant = await self.get(id)
-        return servant.skills
+    async def get_skills(self, id: int) -> List[Skill]:
+        query = (
+            select(Servant)
+            .where(Servant.id == id)
+            .options(selectinload(Servant.skills).selectinload(ServantSkill.skill))
+        )
+        servant = (await self.db.execute(query)).scalars().first()
+        if not servant:
+            raise ValueError("Servant does not exist")
+        return [servant_skill.skill for servant_skill in servant.skills]
 
     async def get_skill(self, id: int):
         query = select(Skill).where(Skill.id == id)
         return (await self.db.execute(query)).scalars().first()
 
-    async def get_all_skills(self):
+    async def get_all_skills(self) -> List[SkillResponse]:
+        return await catalog_cache.get_or_load(("skills",), self._load_all_skills)
+
+    async def _load_all_skills(self) -> List[SkillResponse]:
+        use_primary(self.db)
         query = select(Skill)
-        return (await self.db.execute(query)).scalars().all()
+        skills = (await self.db.execute(query)).scalars().all()
+        return list(map(SkillResponse.model_validate, skills))
 
     async def delete_skill(self, id):
-        skill = self.get(id)
+        skill = await self.get_skill(id)
         await self.db.delete(skill)
         await self.db.commit()
+        catalog_cache.invalidate("skills")
+        catalog_cache.invalidate("image_path", "skill", int(id))
 
     async def add_skill_picture(self, id, path):
         skill = await self.get_skill(id)
         skill.icon = path
         await self.db.commit()
+        catalog_cache.invalidate("skills")
+        catalog_cache.invalidate("image_path", "skill", int(id))
+        schedule_derivatives(path)
 
     async def get_skill_icon(self, id):
+        icon = await catalog_cache.get_or_load(
+            ("image_path", "skill", int(id)), lambda: self._load_skill_icon(id)
+        )
+        if icon is None:
+            raise ValueError("no skill icon")
+        return icon
+
+    async def _load_skill_icon(self, id) -> str | None:
+        use_primary(self.db)
         skill = await self.get_skill(id)
-        return skill.icon
+        return skill.icon if skill else None
 
     async def add_picture(self, servant_id: int, grade: int, path: str):
-        new_picture = ServantPicture(grade=1, picture=path)
-        servant = await self.get(servant_id)
-        servant.pictures.append(new_picture)
+        new_picture = await self.db.merge(
+            ServantPicture(servant_id=servant_id, grade=grade, picture=path)
+        )
         try:
             await self.db.commit()
-            return new_picture
         except Exception as e:
             await self.db.rollback()
             raise e
+        catalog_cache.invalidate("image_path", "picture", int(servant_id), int(grade))
+        schedule_derivatives(path)
+        return new_picture
 
     async def get_picture(self, servant_id: int, grade: int):
-        sp = ServantPicture
-        query = select(sp).where(sp.servant_id == servant_id, sp.grade == 1)
-        result = await self.db.execute(query)
-        picture = result.scalars().first()
-        if picture:
-            return picture.picture
-        else:
+        # misses are cached too, so revalidating a missing image stays off the db
+        picture = await catalog_cache.get_or_load(
+            ("image_path", "picture", int(servant_id), int(grade)),
+            lambda: self._load_picture(servant_id, grade),
+        )
+        if picture is None:
             raise ValueError("no picture")
+        return picture
 
-    async def get_level_analys(self):
-        return (
-            self.db.query(
-                Servant.class_name,
-                func.max(Servant.level).label("max_level"),
-                func.min(Servant.level).label("min_level"),
-                func.avg(Servant.level).label("avg_level"),
+    async def get_picture_batch(
+        self,
+        servant_ids: List[int] | None = None,
+        filters: ServantFilter | None = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+    ) -> PictureBatch:
+        # either explicit ids or the same page /servants would return for
+        # these filters and cursor; the cursor is interchangeable between both
+        next_cursor = None
+        if servant_ids is None:
+            query = self._page_query(select(Servant.id), filters, limit, cursor)
+            servant_ids = (await self.db.execute(query)).scalars().all()
+            if len(servant_ids) > limit:
+                servant_ids = servant_ids[:limit]
+                next_cursor = encode_cursor({"id": servant_ids[-1]})
+        if not servant_ids:
+            return PictureBatch(items=[], next_cursor=next_cursor)
+        sp = ServantPicture
+        # one array parameter instead of an IN list keeps a single prepared
+        # statement whatever the number of ids
+        query = (
+            select(sp.servant_id, sp.grade, sp.picture)
+            .where(
+                sp.servant_id
+                == any_(bindparam("servant_ids", list(servant_ids), ARRAY(Integer)))
             )
-            .group_by(Servant.class_name)
-            .all()
+            .order_by(sp.servant_id, sp.grade)
+        )
+        rows = (await self.db.execute(query)).all()
+        infos = await run_in_threadpool(
+            self._picture_infos, [row.picture for row in rows]
         )
+        items = []
+        for row, info in zip(rows, infos):
+            url = public_url(row.picture) if row.picture else None
+            if url is None:
+                url = f"/get_image?servant_id={row.servant_id}&grade={row.grade}"
+            items.append(
+                PictureMetadata(
+                    servant_id=row.servant_id,
+                    grade=row.grade,
+                    url=url,
+                    width=info.width if info else None,
+                    height=info.height if info else None,
+                    sha256=info.digest if info else None,
+                    size=info.size if info else None,
+                )
+            )
+        return PictureBatch(items=items, next_cursor=next_cursor)
+
+    @staticmethod
+    def _picture_infos(paths: List[str | None]) -> list:
+        infos = []
+        for path in paths:
+            try:
+                infos.append(image_info(path) if path else None)
+            except OSError:
+                infos.append(None)
+        return infos
+
+    async def _load_picture(self, servant_id: int, grade: int) -> str | None:
+        use_primary(self.db)
+        sp = ServantPicture
+        query = select(sp.picture).where(sp.servant_id == servant_id, sp.grade == grade)
+        return (await self.db.execute(query)).scalars().first()
+
+    async def get_level_analys(self) -> List[ClassLevelStats]:
+        query = select(ClassLevelSummary).order_by(ClassLevelSummary.class_name)
+        rows = (await self.db.execute(query)).scalars().all()
+        return [
+            ClassLevelStats(
+                class_name=row.class_name,
+                max_level=row.max_level,
+                min_level=row.min_level,
+                avg_level=row.avg_level,
+            )
+            for row in rows
+        ]
 
-    def get_summoned_servants(self):
-        return (
-            self.db.query(
+    async def get_summoned_servants(self):
+        query = (
+            select(
                 Servant.name.label("servant_name"),
                 ServantLocalization.name.label("localization_name"),
                 Master.nickname.label("master_nickname"),
@@ -325,56 +644,41 @@ class ServantService:
             .join(Contract, Servant.id == Contract.servant_id)
             .join(Master, Contract.master_id == Master.id)
             .join(ServantLocalization, Servant.id == ServantLocalization.servant_id)
-            .filter(ServantLocalization.language == "ru")
-            .all()
+            .where(ServantLocalization.language == "ru")
         )
+        return (await self.db.execute(query)).all()
 
-    def get_female_servants(self):
-        return (
-            self.db.query(
+    async def get_female_servants(self):
+        query = (
+            select(
                 Servant.name.label("servant_name"),
                 ServantLocalization.language.label("language"),
                 ServantLocalization.description.label("description"),
             )
             .join(ServantLocalization)
-            .filter(
+            .where(
                 Servant.gender == "female",
                 ServantLocalization.language.in_(["ru", "en"]),
             )
-            .all()
-        )
-
-    def get_top_servants(self):
-        stmt = (
-            self.db.query(
-                Contract.master_id,
-                Servant.id.label("servant_id"),
-                Servant.level,
-                func.row_number()
-                .over(partition_by=Contract.master_id, order_by=Servant.level.desc())
-                .label("rank"),
-            )
-            .join(Servant, Servant.id == Contract.servant_id)
-            .subquery()
         )
+        return (await self.db.execute(query)).all()
 
+    async def get_top_servants(self) -> List[TopServantResponse]:
         query = (
-            self.db.query(
+            select(
                 Master.nickname.label("master_nickname"),
                 ServantLocalization.name.label("servant_name"),
-                stmt.c.level.label("servant_level"),
+                MasterTopServant.servant_level,
             )
-            .join(Master, stmt.c.master_id == Master.id)
+            .join(Master, MasterTopServant.master_id == Master.id)
             .join(
                 ServantLocalization,
                 and_(
-                    stmt.c.servant_id == ServantLocalization.servant_id,
+                    MasterTopServant.servant_id == ServantLocalization.servant_id,
                     ServantLocalization.language == "en",
                 ),
             )
-            .filter(stmt.c.rank <= 3)
-            .order_by(Master.nickname, stmt.c.rank)
-            .all()
+            .order_by(Master.nickname, MasterTopServant.rank)
         )
         response = [
             TopServantResponse(
@@ -382,12 +686,108 @@ class ServantService:
                 servant_name=row.servant_name,
                 servant_level=row.servant_level,
             )
-            for row in query
+            for row in await self.db.execute(query)
         ]
 
         return response
 
 
+class AnalyticsService:
+    # Keeps class_level_summary and master_top_servant in step with servant
+    # and contract writes. Callers run these inside their own transaction,
+    # before commit, so a summary row never outlives the change behind it.
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def refresh_class_levels(self, *class_names: str):
+        class_names = [name for name in set(class_names) if name]
+        if not class_names:
+            return
+        await self.db.execute(
+            delete(ClassLevelSummary).where(
+                ClassLevelSummary.class_name.in_(class_names)
+            )
+        )
+        await self.db.execute(
+            insert(ClassLevelSummary).from_select(
+                [
+                    ClassLevelSummary.class_name,
+                    ClassLevelSummary.servant_count,
+                    ClassLevelSummary.max_level,
+                    ClassLevelSummary.min_level,
+                    ClassLevelSummary.avg_level,
+                ],
+                select(
+                    Servant.class_name,
+                    func.count(),
+                    func.max(Servant.level),
+                    func.min(Servant.level),
+                    func.avg(Servant.level),
+                )
+                .where(Servant.class_name.in_(class_names))
+                .group_by(Servant.class_name),
+            )
+        )
+
+    async def refresh_top_servants(self, *master_ids: int):
+        master_ids = list(set(master_ids))
+        if not master_ids:
+            return
+        ranked = (
+            select(
+                Contract.master_id,
+                Servant.id.label("servant_id"),
+                Servant.level,
+                func.row_number()
+                .over(partition_by=Contract.master_id, order_by=Servant.level.desc())
+                .label("rank"),
+            )
+            .join(Servant, Servant.id == Contract.servant_id)
+            .where(Contract.master_id.in_(master_ids))
+            .subquery()
+        )
+        await self.db.execute(
+            delete(MasterTopServant).where(MasterTopServant.master_id.in_(master_ids))
+        )
+        await self.db.execute(
+            insert(MasterTopServant).from_select(
+                [
+                    MasterTopServant.master_id,
+                    MasterTopServant.rank,
+                    MasterTopServant.servant_id,
+                    MasterTopServant.servant_level,
+                ],
+                select(
+                    ranked.c.master_id,
+                    ranked.c.rank,
+                    ranked.c.servant_id,
+                    ranked.c.level,
+                ).where(ranked.c.rank <= 3),
+            )
+        )
+
+    async def masters_of(self, servant_id: int) -> List[int]:
+        query = select(Contract.master_id).where(Contract.servant_id == servant_id)
+        return list((await self.db.execute(query)).scalars().all())
+
+    async def refresh_for_servant(self, servant_id: int, *class_names: str):
+        await self.refresh_class_levels(*class_names)
+        await self.refresh_top_servants(*await self.masters_of(servant_id))
+
+    async def rebuild(self):
+        await self.db.execute(delete(ClassLevelSummary))
+        await self.db.execute(delete(MasterTopServant))
+        class_names = (
+            await self.db.execute(select(Servant.class_name).distinct())
+        ).scalars()
+        await self.refresh_class_levels(*class_names)
+        master_ids = (
+            await self.db.execute(select(Contract.master_id).distinct())
+        ).scalars()
+        await self.refresh_top_servants(*master_ids)
+        await self.db.commit()
+
+
 class MasterService:
     def __init__(self, db: AsyncSession):
         self.db = db
@@ -396,9 +796,43 @@ class MasterService:
         query = select(Master).where(Master.id == id)
         return (await self.db.execute(query)).scalars().first()
 
-    async def get_all(self) -> List[Master]:
-        query = select(Master)
-        return (await self.db.execute(query)).scalars().all()
+    async def get_all(
+        self,
+        filters: MasterFilter | None = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+        embed_contracts: bool = False,
+    ) -> MasterPage:
+        query = select(Master).order_by(Master.id).limit(limit + 1)
+        if cursor:
+            (last_id,) = cursor_values(cursor, "id")
+            query = query.where(Master.id > last_id)
+        if filters:
+            query = filter_masters(
+                query,
+                filters.min_level,
+                filters.max_level,
+                filters.registered_from,
+                filters.registered_to,
+            )
+        if embed_contracts:
+            # one more query for the whole page, whatever the contract count
+            query = query.options(
+                selectinload(Master.contracts).joinedload(Contract.servant)
+            )
+        masters = (await self.db.execute(query)).scalars().all()
+        next_cursor = None
+        if len(masters) > limit:
+            masters = masters[:limit]
+            next_cursor = encode_cursor({"id": masters[-1].id})
+        if embed_contracts:
+            items = list(map(MasterDetail.model_validate, masters))
+        else:
+            items = [
+                MasterDetail(**MasterResponse.model_validate(m).model_dump())
+                for m in masters
+            ]
+        return MasterPage(items=items, next_cursor=next_cursor)
 
     async def create(self, master: MasterCreate):
         new_master = Master(
@@ -432,11 +866,11 @@ class MasterService:
         if master.display_name:
             m.display_name = master.display_name
         try:
-            self.db.commit()
-            self.db.refresh(m)
+            await self.db.commit()
+            await self.db.refresh(m)
             return m
         except IntegrityError as e:
-            self.db.rollback()
+            await self.db.rollback()
             if isinstance(e.orig, UniqueViolation):
                 raise ValueError("Master with this nickname already exists")
             if isinstance(e.orig, CheckViolation):
@@ -449,31 +883,120 @@ class MasterService:
         await self.db.delete(m)
         await self.db.commit()
 
-    async def get_active_contracts_count(self, master_id):
-        query = select(Contract).where(
-            (Contract.master_id == master_id) & (Contract.status == "active")
+    async def get_active_contracts_count(self, master_id) -> int:
+        # index-only scan of ix_contract_master_status
+        query = (
+            select(func.count())
+            .select_from(Contract)
+            .where(Contract.master_id == master_id, Contract.status == CONTRACT_ACTIVE)
         )
-        c = (await self.db.execute(query)).scalars().all()
-        return len(c)
+        return (await self.db.execute(query)).scalar_one()
+
+
+def filter_masters(query, min_level, max_level, registered_from, registered_to):
+    if min_level is not None:
+        query = query.where(Master.level >= min_level)
+    if max_level is not None:
+        query = query.where(Master.level <= max_level)
+    if registered_from is not None:
+        query = query.where(Master.date_registered >= registered_from)
+    if registered_to is not None:
+        query = query.where(Master.date_registered < registered_to)
+    return query
+
+
+def contract_error(e: DBAPIError) -> str | None:
+    # by SQLSTATE, which both psycopg2 and the asyncpg adapter expose as
+    # pgcode; None for anything that is not a known contract rule
+    code = getattr(e.orig, "pgcode", None)
+    if code == "23505":
+        return "Contract already exist"
+    if code == "23503":
+        if "contract_master_id_fkey" in str(e):
+            return "Master does not exist"
+        return "Servant does not exist"
+    if code == "P0001":
+        # raised by the contract trigger
+        return "Servant already has an active contract"
+    return None
 
 
 class ContractService:
     def __init__(self, db: AsyncSession):
         self.db = db
 
-    async def get(self, servant_id, master_id):
-        query = select(Contract).where(
-            Contract.master_id == master_id & Contract.servant_id == servant_id
-        )
-        return (await self.db.execute(query)).scalars().first()
+    async def get(self, servant_id, master_id) -> Contract | None:
+        return await self.db.get(Contract, (master_id, servant_id))
 
-    async def get_all(self):
-        query = select(Contract)
-        return (await self.db.execute(query)).scalars().all()
+    async def get_all(
+        self,
+        filters: ContractFilter | None = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+        embed: tuple[str, ...] = (),
+    ) -> ContractPage:
+        query = (
+            select(Contract)
+            .order_by(Contract.master_id, Contract.servant_id)
+            .limit(limit + 1)
+        )
+        if cursor:
+            last = cursor_values(cursor, "master_id", "servant_id")
+            query = query.where(tuple_(Contract.master_id, Contract.servant_id) > last)
+        join_master = join_servant = False
+        if filters:
+            if filters.status is not None:
+                query = query.where(Contract.status == filters.status)
+            if filters.master_id is not None:
+                query = query.where(Contract.master_id == filters.master_id)
+            if filters.servant_id is not None:
+                query = query.where(Contract.servant_id == filters.servant_id)
+            if filters.servant_class:
+                join_servant = True
+                query = query.where(Servant.class_name == filters.servant_class)
+            master_filters = (
+                filters.min_master_level,
+                filters.max_master_level,
+                filters.registered_from,
+                filters.registered_to,
+            )
+            if any(value is not None for value in master_filters):
+                join_master = True
+                query = filter_masters(query, *master_filters)
+        # many-to-one, so embedding joins into the same statement; a join
+        # already made for a filter is reused rather than added twice
+        for relationship, joined, name in (
+            (Contract.master, join_master, "master"),
+            (Contract.servant, join_servant, "servant"),
+        ):
+            if joined:
+                query = query.join(relationship)
+            if name in embed:
+                option = contains_eager if joined else joinedload
+                query = query.options(option(relationship))
+            else:
+                query = query.options(noload(relationship))
+        contracts = (await self.db.execute(query)).scalars().all()
+        next_cursor = None
+        if len(contracts) > limit:
+            contracts = contracts[:limit]
+            next_cursor = encode_cursor(
+                {
+                    "master_id": contracts[-1].master_id,
+                    "servant_id": contracts[-1].servant_id,
+                }
+            )
+        return ContractPage(
+            items=list(map(ContractDetail.model_validate, contracts)),
+            next_cursor=next_cursor,
+        )
 
     async def delete(self, servant_id, master_id):
         contract = await self.get(servant_id=servant_id, master_id=master_id)
+        if contract is None:
+            raise ValueError("Contract does not exist")
         await self.db.delete(contract)
+        await AnalyticsService(self.db).refresh_top_servants(master_id)
         await self.db.commit()
 
     async def create(self, contract_create: ContractCreate):
@@ -482,19 +1005,425 @@ class ContractService:
         )
         self.db.add(contract)
         try:
+            await AnalyticsService(self.db).refresh_top_servants(contract.master_id)
             await self.db.commit()
             await self.db.refresh(contract)
             return contract
-        except IntegrityError as e:
+        except DBAPIError as e:
             await self.db.rollback()
-            if isinstance(e.orig, UniqueViolation):
-                raise ValueError("Contract already exist")
-            if isinstance(e.orig, ForeignKeyViolation):
-                if "contract_master_id_fkey" in str(e):
-                    raise ValueError("Master does not exist")
-                else:
-                    raise ValueError("Servant does not exist")
-        except InternalError as e:
+            error = contract_error(e)
+            if error is None:
+                raise
+            raise ValueError(error)
+
+    async def _apply(self, operation: ContractOperation) -> str | None:
+        key = (
+            Contract.master_id == operation.master_id,
+            Contract.servant_id == operation.servant_id,
+        )
+        if operation.action == "create":
+            await self.db.execute(
+                insert(Contract).values(
+                    master_id=operation.master_id, servant_id=operation.servant_id
+                )
+            )
+            return None
+        if operation.action == "end":
+            result = await self.db.execute(
+                update(Contract)
+                .where(*key, Contract.status == CONTRACT_ACTIVE)
+                .values(status=CONTRACT_TERMINATED, end_date=datetime.now())
+            )
+            return None if result.rowcount else "No active contract"
+        result = await self.db.execute(delete(Contract).where(*key))
+        return None if result.rowcount else "Contract does not exist"
+
+    async def apply_batch(
+        self, operations: List[ContractOperation]
+    ) -> ContractBatchResult:
+        # one transaction; each operation runs in a savepoint, so a rejected
+        # one is rolled back alone and reported with its index
+        results = []
+        masters = set()
+        for index, operation in enumerate(operations):
+            try:
+                async with self.db.begin_nested():
+                    error = await self._apply(operation)
+            except DBAPIError as e:
+                error = contract_error(e)
+                if error is None:
+                    await self.db.rollback()
+                    raise
+            if error is None:
+                masters.add(operation.master_id)
+            results.append(
+                ContractOperationResult(
+                    index=index, **operation.model_dump(), ok=error is None, error=error
+                )
+            )
+        await AnalyticsService(self.db).refresh_top_servants(*masters)
+        await self.db.commit()
+        succeeded = sum(result.ok for result in results)
+        return ContractBatchResult(
+            results=results, succeeded=succeeded, failed=len(results) - succeeded
+        )
+
+
+# inlined rather than bound so the expressions match the GIN indexes
+# created by queries/search.sql and migration 0002
+TS_CONFIG = literal_column("'simple'")
+
+
+def _text_match(column, term: str, tsquery, document=None):
+    document = func.to_tsvector(TS_CONFIG, column if document is None else document)
+    score = func.greatest(
+        func.similarity(column, term), func.ts_rank(document, tsquery)
+    )
+    return score, or_(column.op("%")(term), document.op("@@")(tsquery))
+
+
+class SearchService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def search(
+        self, term: str, language: str | None = None, limit: int = 20
+    ) -> List[SearchResult]:
+        tsquery = func.plainto_tsquery(TS_CONFIG, term)
+
+        score, match = _text_match(Servant.name, term, tsquery)
+        servant_hits = select(Servant.id.label("servant_id"), score.label("score"))
+        servant_hits = servant_hits.where(match)
+
+        score, match = _text_match(Alias.name, term, tsquery)
+        alias_hits = select(Alias.servant_id, score).where(match)
+        if language:
+            alias_hits = alias_hits.where(Alias.language_code == language)
+
+        loc = ServantLocalization
+        document = (
+            func.coalesce(loc.name, literal_column("''"))
+            + literal_column("' '")
+            + func.coalesce(loc.description, literal_column("''"))
+        )
+        score, match = _text_match(loc.name, term, tsquery, document)
+        localization_hits = select(loc.servant_id, score).where(match)
+        if language:
+            localization_hits = localization_hits.where(loc.language == language)
+
+        hits = union_all(servant_hits, alias_hits, localization_hits).subquery()
+        ranked = (
+            select(hits.c.servant_id, func.max(hits.c.score).label("score"))
+            .group_by(hits.c.servant_id)
+            .subquery()
+        )
+        query = (
+            select(Servant, ranked.c.score)
+            .join(ranked, Servant.id == ranked.c.servant_id)
+            .order_by(ranked.c.score.desc(), Servant.id)
+            .limit(limit)
+        )
+        return [
+            SearchResult(
+                **ServantResponse.model_validate(servant).model_dump(), score=score
+            )
+            for servant, score in await self.db.execute(query)
+        ]
+
+    async def load_names(self):
+        use_primary(self.db)
+        query = union_all(
+            select(Servant.id, null(), Servant.name),
+            select(Alias.servant_id, Alias.language_code, Alias.name),
+            select(
+                ServantLocalization.servant_id,
+                ServantLocalization.language,
+                ServantLocalization.name,
+            ),
+        )
+        return (await self.db.execute(query)).all()
+
+
+IMPORT_CHUNK_SIZE = 1000
+
+# payload key -> (model, row schema, conflict columns), in write order
+IMPORT_ENTITIES = {
+    "servants": (Servant, ServantImport, ["id"]),
+    "skills": (Skill, SkillImport, ["id"]),
+    "noble_phantasms": (NoblePhantasm, NoblePhantasmUpdate, ["servant_id"]),
+    "localizations": (
+        ServantLocalization,
+        LocalizationImport,
+        ["servant_id", "language"],
+    ),
+}
+IMPORT_TYPES = {
+    "servant": "servants",
+    "skill": "skills",
+    "noble_phantasm": "noble_phantasms",
+    "localization": "localizations",
+}
+
+
+# response field, model, schema; every model has an indexed row_version
+SYNC_ENTITIES = (
+    ("servants", Servant, SyncServant),
+    ("localizations", ServantLocalization, LocalizationRecord),
+    ("skills", Skill, SkillResponse),
+    ("noble_phantasms", NoblePhantasm, NoblePhantasmResponse),
+    ("pictures", ServantPicture, PictureResponse),
+    ("deleted", SyncTombstone, SyncDeletion),
+)
+
+
+# one of the triggers migration 0004 installs on either dialect
+SYNC_TRIGGER = "servant_tombstone"
+
+
+class ChangeTrackingMissing(Exception):
+    pass
+
+
+class SyncTokenAhead(Exception):
+    # the token names a version the catalog never reached, e.g. after a
+    # restore; the client has to drop its copy and sync from scratch
+    pass
+
+
+def decode_sync_token(token: str) -> int:
+    try:
+        (version,) = cursor_values(token, "version")
+    except ValueError:
+        raise ValueError("Invalid sync token")
+    return version
+
+
+class SyncService:
+    # set once the triggers were found; they don't go away at runtime
+    tracking_installed = False
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def check_tracking(self):
+        # Base.metadata.create_all makes row_version without the triggers
+        # that set it; every version would stay 0 and no change would show
+        if SyncService.tracking_installed:
+            return
+        if self.db.get_bind().dialect.name == "postgresql":
+            query = text("SELECT 1 FROM pg_trigger WHERE tgname = :name")
+        else:
+            query = text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"
+            )
+        if (await self.db.execute(query, {"name": SYNC_TRIGGER})).first() is None:
+            raise ChangeTrackingMissing(
+                "Change tracking triggers are missing; run alembic upgrade head"
+            )
+        SyncService.tracking_installed = True
+
+    async def latest_version(self) -> int:
+        # one statement; each max() is read from the end of a row_version index
+        versions = union_all(
+            *(
+                select(func.max(model.row_version).label("version"))
+                for _, model, _ in SYNC_ENTITIES
+            )
+        ).subquery()
+        query = select(func.coalesce(func.max(versions.c.version), 0))
+        return (await self.db.execute(query)).scalar_one()
+
+    async def changes(
+        self, since: str | None = None, limit: int = SYNC_PAGE_SIZE
+    ) -> SyncResponse:
+        # without a token the client has nothing yet: every row, no deletions
+        version = -1 if since is None else decode_sync_token(since)
+        await self.check_tracking()
+        latest = await self.latest_version()
+        if version > latest:
+            raise SyncTokenAhead(
+                "Sync token is ahead of the catalog; sync again without since"
+            )
+        if version == latest:
+            return SyncResponse(token=since)
+        # rows above latest may belong to writes still in flight when it was
+        # read; they come with the next sync instead
+        rows = {}
+        for name, model, _ in SYNC_ENTITIES:
+            if model is SyncTombstone and since is None:
+                rows[name] = []
+                continue
+            query = (
+                select(model)
+                .where(model.row_version > version, model.row_version <= latest)
+                .order_by(model.row_version)
+                .limit(limit + 1)
+            )
+            if model is Servant:
+                query = query.options(selectinload(Servant.skills))
+            rows[name] = (await self.db.execute(query)).scalars().all()
+        # a full page cuts every list at the same version, so the token
+        # never skips a row of a list that was not full
+        upto = min(
+            (
+                batch[limit - 1].row_version
+                for batch in rows.values()
+                if len(batch) > limit
+            ),
+            default=latest,
+        )
+        return SyncResponse(
+            token=encode_cursor({"version": upto}),
+            has_more=upto < latest,
+            **{
+                name: [
+                    schema.model_validate(row)
+                    for row in rows[name]
+                    if row.row_version <= upto
+                ]
+                for name, _, schema in SYNC_ENTITIES
+            },
+        )
+
+
+class ImportService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    @staticmethod
+    def from_json(payload: CatalogImport) -> dict[str, list[tuple[int, dict]]]:
+        return {
+            entity: list(enumerate(getattr(payload, entity)))
+            for entity in IMPORT_ENTITIES
+        }
+
+    @staticmethod
+    async def from_ndjson(chunks, errors: List[ImportRowError]):
+        # one object per line with a "type" of servant, skill,
+        # noble_phantasm or localization; index is the line number
+        rows = {entity: [] for entity in IMPORT_ENTITIES}
+        line_number = 0
+        pending = b""
+        async for chunk in chunks:
+            *lines, pending = (pending + chunk).split(b"\n")
+            for line in lines:
+                line_number += 1
+                ImportService._parse_line(line, line_number, rows, errors)
+        ImportService._parse_line(pending, line_number + 1, rows, errors)
+        return rows
+
+    @staticmethod
+    def _parse_line(line: bytes, line_number: int, rows: dict, errors: list):
+        if not line.strip():
+            return
+        try:
+            raw = orjson.loads(line)
+            entity = IMPORT_TYPES[raw.pop("type")]
+        except (orjson.JSONDecodeError, AttributeError, KeyError, TypeError):
+            errors.append(
+                ImportRowError(
+                    entity="line",
+                    index=line_number,
+                    error="expected a JSON object with a known type",
+                )
+            )
+            return
+        rows[entity].append((line_number, raw))
+
+    async def run(
+        self,
+        rows: dict[str, list[tuple[int, dict]]],
+        errors: List[ImportRowError] | None = None,
+    ) -> ImportResult:
+        result = ImportResult(written={}, errors=errors or [])
+        for entity, (model, schema, keys) in IMPORT_ENTITIES.items():
+            valid = []
+            for index, raw in rows.get(entity, []):
+                try:
+                    valid.append((index, schema.model_validate(raw)))
+                except ValidationError as e:
+                    message = "; ".join(
+                        f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                        for error in e.errors()
+                    )
+                    result.errors.append(
+                        ImportRowError(entity=entity, index=index, error=message)
+                    )
+            written = 0
+            for start in range(0, len(valid), IMPORT_CHUNK_SIZE):
+                chunk = valid[start : start + IMPORT_CHUNK_SIZE]
+                written += await self._write_chunk(
+                    entity, model, keys, chunk, result.errors
+                )
+            result.written[entity] = written
+        if any(result.written.values()):
+            await self._sync_sequences()
+            if result.written.get("servants"):
+                await AnalyticsService(self.db).rebuild()
+            for entity in (
+                "servant_list",
+                "skills",
+                "np",
+                "localization",
+                "image_path",
+            ):
+                catalog_cache.invalidate(entity)
+        return result
+
+    def _upsert(self, model, keys: List[str], fields: tuple):
+        mapper = model.__mapper__
+        stmt = pg_insert(model)
+        columns = [
+            mapper.attrs[field].columns[0].name for field in fields if field not in keys
+        ]
+        if not columns:
+            return stmt.on_conflict_do_nothing(index_elements=keys)
+        return stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={column: stmt.excluded[column] for column in columns},
+        )
+
+    async def _execute(self, model, keys, values: List[dict]):
+        # rows that leave out different optional fields need their own
+        # statement, so unset columns keep their current values on conflict
+        groups = {}
+        for row in values:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for fields, group in groups.items():
+            await self.db.execute(self._upsert(model, keys, fields), group)
+
+    async def _write_chunk(self, entity, model, keys, chunk, errors) -> int:
+        values = [row.model_dump(exclude_unset=True) for _, row in chunk]
+        try:
+            await self._execute(model, keys, values)
+            await self.db.commit()
+            return len(chunk)
+        except DBAPIError:
             await self.db.rollback()
-            if isinstance(e.orig, RaiseException):
-                raise ValueError("Servant already has an active contract")
+        # something in the chunk was rejected: retry row by row in
+        # savepoints to keep the good rows and report the bad ones
+        written = 0
+        for (index, _), row in zip(chunk, values):
+            try:
+                async with self.db.begin_nested():
+                    await self._execute(model, keys, [row])
+                written += 1
+            except DBAPIError as e:
+                errors.append(
+                    ImportRowError(entity=entity, index=index, error=str(e.orig))
+                )
+        await self.db.commit()
+        return written
+
+    async def _sync_sequences(self):
+        # explicit ids bypass the serial sequences; move them past the new rows
+        if self.db.get_bind().dialect.name != "postgresql":
+            return
+        for table in ("servant", "skill"):
+            await self.db.execute(
+                text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM {table}), 1))"
+                )
+            )
+        await self.db.commit()
@@ -1,43 +1,251 @@
-from sqlalchemy.orm import DeclarativeBase, sessionmaker
+from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy import create_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import create_engine, event, exc, make_url, text
+from starlette.requests import Request
 from dotenv import load_dotenv
+import asyncio
 import os
+import time
 import logging
 
-class FormatLog(logging.Filter):
-    def filter(self, record: logging.LogRecord) -> bool | logging.LogRecord:
-        return '[raw sql]' not in record
-
-
 log_path = os.getenv('LOG_PATH', '/tmp/sqlalchemy.log')
+LOG_SQL = os.getenv('LOG_SQL', 'false').lower() in ('1', 'true', 'yes')
 
 logging.basicConfig(
     filename=log_path,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
-logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
+# one summary line per request from app.instrumentation; every statement
+# only when asked for
+logging.getLogger('app').setLevel(logging.INFO)
+if LOG_SQL:
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
 
 # load_dotenv()
 DATABASE_URL = os.environ.get('DATABASE_URL')
 # DATABASE_URL = os.getenv('DATABASE_URL')
 
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 100))
+
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+]
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', 5))
+
 class Base(DeclarativeBase):
     def _repr(self, *fields):
         attrs = ', '.join(f'{field}={repr(getattr(self, field))}' for field in fields)
         return f'<{self.__class__.__name__}({attrs})>' 
     
 
-create_async_engine = create_async_engine(DATABASE_URL, echo=False, future=True)
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    # Counts how long checkouts block, so pool_size/max_overflow can be tuned
+    # per worker against max_connections on the server.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_time += elapsed
+            self.max_wait_time = max(self.max_wait_time, elapsed)
+
+    def stats(self) -> dict:
+        return {
+            'pool_size': self.size(),
+            'max_overflow': self._max_overflow,
+            'checked_in': self.checkedin(),
+            'checked_out': self.checkedout(),
+            'overflow': max(self.overflow(), 0),
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_time_total': self.wait_time,
+            'wait_time_avg': self.wait_time / self.checkouts if self.checkouts else 0.0,
+            'wait_time_max': self.max_wait_time,
+        }
+
+
+def make_engine(url: str):
+    url = make_url(url)
+    connect_args = {}
+    if url.drivername == 'postgresql+asyncpg':
+        # asyncpg's own cache plus the dialect's prepared statement cache;
+        # both have to be 0 behind pgbouncer in transaction mode
+        connect_args['statement_cache_size'] = DB_STATEMENT_CACHE_SIZE
+        url = url.update_query_dict(
+            {'prepared_statement_cache_size': str(DB_STATEMENT_CACHE_SIZE)}
+        )
+    return create_async_engine(
+        url,
+        echo=False,
+        future=True,
+        poolclass=InstrumentedPool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(
-    bind=create_async_engine,
+    bind=engine,
     class_=AsyncSession,
     expire_on_commit=False
 )
 
 
 
-async def get_db():
-    async with SessionLocal() as session:
-        yield session
\ No newline at end of file
+class Replica:
+    def __init__(self, url: str):
+        self.url = make_url(url).render_as_string(hide_password=True)
+        self.engine = make_engine(url)
+        self.healthy = True
+        self.lag = 0.0
+        self.checked_at = None
+        event.listen(self.engine.sync_engine, 'handle_error', self._on_error)
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and self.lag <= REPLICA_MAX_LAG
+
+    def _on_error(self, context):
+        # stop routing here right away; the monitor brings it back
+        if context.is_disconnect or context.connection is None:
+            self.healthy = False
+
+    async def check(self):
+        try:
+            async with self.engine.connect() as conn:
+                if conn.dialect.name == 'postgresql':
+                    query = text(
+                        'SELECT CASE WHEN NOT pg_is_in_recovery() '
+                        'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                        'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+                    )
+                    self.lag = float((await conn.execute(query)).scalar() or 0)
+                else:
+                    await conn.execute(text('SELECT 1'))
+                    self.lag = 0.0
+            self.healthy = True
+        except Exception:
+            self.healthy = False
+        self.checked_at = time.time()
+
+    def stats(self) -> dict:
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'lag': self.lag,
+            'checked_at': self.checked_at,
+            **self.engine.pool.stats(),
+        }
+
+
+class ReplicaSet:
+    def __init__(self, urls: list[str]):
+        self.replicas = [Replica(url) for url in urls]
+        self._next = 0
+        self._monitor = None
+
+    def choose(self) -> Replica | None:
+        available = [replica for replica in self.replicas if replica.available]
+        if not available:
+            return None
+        self._next = (self._next + 1) % len(available)
+        return available[self._next]
+
+    async def check(self):
+        await asyncio.gather(*(replica.check() for replica in self.replicas))
+
+    async def _run_monitor(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+
+    def start(self):
+        if self.replicas and self._monitor is None:
+            self._monitor = asyncio.create_task(self._run_monitor())
+
+    async def stop(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+replicas = ReplicaSet(DATABASE_REPLICA_URLS)
+
+
+class RoutingSession(Session):
+    # SELECTs go to one replica picked on first use; anything else, and every
+    # statement after it, goes to the primary so the request reads its writes.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica = None
+        self.use_primary = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if not self.use_primary and not self._flushing and getattr(clause, 'is_select', False):
+            if self.replica is None or not self.replica.available:
+                self.replica = replicas.choose()
+            if self.replica is not None:
+                return self.replica.engine.sync_engine
+        else:
+            self.use_primary = True
+        return engine.sync_engine
+
+
+ReadSessionLocal = sessionmaker(
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    expire_on_commit=False
+)
+
+
+def use_primary(session: AsyncSession):
+    # for reads whose result outlives the request, e.g. the catalog cache
+    sync_session = session.sync_session
+    if isinstance(sync_session, RoutingSession):
+        sync_session.use_primary = True
+
+
+def new_session(read_only: bool = False) -> AsyncSession:
+    if read_only and replicas.replicas:
+        return ReadSessionLocal()
+    return SessionLocal()
+
+
+async def get_db(request: Request):
+    async with new_session(request.method in ('GET', 'HEAD')) as session:
+        yield session
+
+
+def pool_stats() -> dict:
+    return {
+        'pid': os.getpid(),
+        'primary': engine.pool.stats(),
+        'replicas': [replica.stats() for replica in replicas.replicas],
+    }
@@ -0,0 +1,95 @@
+import csv
+import io
+
+from .crud import ServantService
+from .database import new_session
+
+EXPORT_CHUNK_SIZE = 500
+
+CSV_COLUMNS = [
+    "id",
+    "name",
+    "class_name",
+    "ascension_level",
+    "level",
+    "alignment",
+    "gender",
+    "state",
+    "language",
+    "localized_name",
+    "description",
+    "history",
+    "prototype_person",
+    "illustrator",
+    "voice_actor",
+    "temper",
+    "intro",
+    "np_name",
+    "np_rank",
+    "np_type",
+    "np_description",
+    "skill_ids",
+]
+
+
+async def _servant_chunks():
+    # the request's own session is closed before a streaming body is sent,
+    # so the export reads through a session of its own
+    async with new_session(read_only=True) as db:
+        async for chunk in ServantService(db).export(EXPORT_CHUNK_SIZE):
+            yield chunk
+
+
+async def stream_ndjson():
+    async for chunk in _servant_chunks():
+        yield "".join(
+            servant.model_dump_json(by_alias=True) + "\n" for servant in chunk
+        )
+
+
+def _csv_rows(servant):
+    np = servant.noble_phantasm
+    common = [
+        servant.id,
+        servant.name,
+        servant.class_name,
+        servant.ascension_level,
+        servant.level,
+        servant.alignment,
+        servant.gender,
+        servant.state,
+    ]
+    tail = [
+        np.name if np else None,
+        np.rank if np else None,
+        np.activation_type if np else None,
+        np.description if np else None,
+        ";".join(str(skill.id) for skill in servant.skills),
+    ]
+    if not servant.localizations:
+        yield common + [None] * 9 + tail
+    for loc in servant.localizations:
+        yield common + [
+            loc.language,
+            loc.name,
+            loc.description,
+            loc.history,
+            loc.prototype_person,
+            loc.illustrator,
+            loc.voice_actor,
+            loc.temper,
+            loc.intro,
+        ] + tail
+
+
+async def stream_csv():
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    yield buffer.getvalue()
+    async for chunk in _servant_chunks():
+        buffer.seek(0)
+        buffer.truncate()
+        for servant in chunk:
+            writer.writerows(_csv_rows(servant))
+        yield buffer.getvalue()
@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+STATEMENT_LOG_LENGTH = 300
+
+
+class QueryStats:
+    def __init__(self, budget: int | None = None):
+        self.budget = budget
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement: str, duration: float, rows: int):
+        self.queries += 1
+        self.db_time += duration
+        self.rows += max(rows, 0)
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+
+    @property
+    def over_budget(self) -> bool:
+        return self.budget is not None and self.queries > self.budget
+
+    def as_dict(self) -> dict:
+        return {
+            "queries": self.queries,
+            "db_ms": round(self.db_time * 1000, 3),
+            "rows": self.rows,
+            "slowest_ms": round(self.slowest_time * 1000, 3),
+            "slowest_sql": (self.slowest_statement or "")[:STATEMENT_LOG_LENGTH],
+            "budget": self.budget,
+        }
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+# every collector active in the current context: the request's own stats
+# plus any query_budget() blocks wrapped around it
+_collectors: ContextVar[tuple[QueryStats, ...]] = ContextVar(
+    "query_collectors", default=()
+)
+_request_stats: ContextVar[QueryStats | None] = ContextVar(
+    "request_query_stats", default=None
+)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+    # -1 where the driver does not report it (sqlite selects)
+    rows = cursor.rowcount
+    for stats in _collectors.get():
+        stats.record(statement, duration, rows)
+    if duration * 1000 >= SLOW_QUERY_MS:
+        logger.warning(
+            json.dumps(
+                {
+                    "event": "slow_query",
+                    "ms": round(duration * 1000, 3),
+                    "rows": rows,
+                    "sql": statement[:STATEMENT_LOG_LENGTH],
+                }
+            )
+        )
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    if context.connection is not None:
+        starts = context.connection.info.get("query_start")
+        if starts:
+            starts.pop()
+
+
+@contextmanager
+def collect(stats: QueryStats):
+    token = _collectors.set((*_collectors.get(), stats))
+    try:
+        yield stats
+    finally:
+        _collectors.reset(token)
+
+
+@contextmanager
+def query_budget(max_queries: int):
+    # for tests: fails the block if the statements it ran, including those
+    # of any in-process requests it made, go over max_queries
+    stats = QueryStats(max_queries)
+    with collect(stats):
+        yield stats
+    if stats.over_budget:
+        raise QueryBudgetExceeded(
+            f"{stats.queries} queries, budget {max_queries}; "
+            f"slowest: {stats.slowest_statement}"
+        )
+
+
+class QueryBudget:
+    # route dependency: Depends(QueryBudget(2)) declares how many statements
+    # the route may run; going over is logged, and raised when strict
+    def __init__(self, max_queries: int):
+        self.max_queries = max_queries
+
+    async def __call__(self):
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.budget = self.max_queries
+
+
+def current_query_stats() -> QueryStats | None:
+    return _request_stats.get()
+
+
+def server_timing(stats: QueryStats, total: float) -> str:
+    return (
+        f'db;dur={stats.db_time * 1000:.3f};desc="{stats.queries} queries, '
+        f'{stats.rows} rows", db-slowest;dur={stats.slowest_time * 1000:.3f}, '
+        f"app;dur={total * 1000:.3f}"
+    )
+
+
+class QueryStatsMiddleware:
+    def __init__(self, app, strict: bool = QUERY_BUDGET_STRICT):
+        self.app = app
+        self.strict = strict
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = QueryStats()
+        started = time.perf_counter()
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # statements run while a streaming body is sent only reach the log
+                header = server_timing(stats, time.perf_counter() - started)
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"server-timing", header.encode("latin-1")),
+                    ],
+                }
+            await send(message)
+
+        token = _request_stats.set(stats)
+        try:
+            with collect(stats):
+                await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stats.reset(token)
+            record = {
+                "event": "request",
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "ms": round((time.perf_counter() - started) * 1000, 3),
+                **stats.as_dict(),
+            }
+            if stats.over_budget:
+                logger.warning(json.dumps({**record, "event": "query_budget"}))
+            else:
+                logger.info(json.dumps(record))
+        if stats.over_budget and self.strict:
+            raise QueryBudgetExceeded(
+                f"{scope['method']} {scope['path']} ran {stats.queries} queries, "
+                f"budget {stats.budget}"
+            )
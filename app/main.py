@@ -1,17 +1,61 @@
 import os
+import secrets
+import time
+from datetime import datetime, timezone
 from pathlib import Path
-from fastapi import FastAPI, Depends, File, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from typing import Literal, Union
+from fastapi import (
+    FastAPI,
+    Depends,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+)
+from fastapi.responses import (
+    FileResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 from .crud import *
-from .database import get_db
+from .cache import catalog_cache
+from .export import stream_csv, stream_ndjson
+from .search import prefix_index
+from . import media
+from .responses import IMMUTABLE, cached_file_response, snapshot_response
+from .snapshot import catalog_snapshots
+from .instrumentation import QueryBudget, QueryStatsMiddleware
+from . import metrics
+from . import profiling
+from .database import get_db, pool_stats, replicas
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 from .schemas import *
 from fastapi.middleware.cors import CORSMiddleware
-from .utils import SKILL_DIR, save_file_to_disk, MEDIA_DIR
+from .utils import (
+    DEFAULT_PAGE_SIZE,
+    LocalizationProjection,
+    MAX_BATCH_SIZE,
+    MAX_PAGE_SIZE,
+    MAX_SYNC_PAGE_SIZE,
+    OBJECT_DIR,
+    SYNC_PAGE_SIZE,
+    StoredFile,
+    UploadTooLarge,
+    localization_projection,
+    parse_accept_language,
+    parse_languages,
+    save_file_to_disk,
+)
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 origins = [
     "https://d0jzr844-3000.euw.devtunnels.ms",
@@ -22,6 +66,9 @@ origins = [
     "http://localhost:4200"
 ]
 
+app.add_middleware(profiling.ProfilerMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(QueryStatsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -31,6 +78,36 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def start_replica_monitor():
+    replicas.start()
+
+
+@app.on_event("startup")
+async def start_catalog_snapshots():
+    catalog_snapshots.start()
+
+
+@app.on_event("shutdown")
+async def stop_replica_monitor():
+    await replicas.stop()
+
+
+@app.on_event("shutdown")
+async def stop_catalog_snapshots():
+    await catalog_snapshots.stop()
+
+
+@app.on_event("shutdown")
+async def stop_image_workers():
+    media.shutdown()
+
+
+@app.on_event("shutdown")
+async def stop_profiler():
+    await run_in_threadpool(profiling.sampler.join)
+
+
 # @app.get('/sql')
 # async def root():
 #     a = engine.connect()
@@ -38,15 +115,15 @@ app.add_middleware(
 #         return str(a.execute(text(f.read())).fetchall())
 
 
-@app.get("/")
+@app.get("/", response_model=MessageResponse)
 async def root():
     return {"message": "Hello World"}
 
 
 @app.get("/summoned_servants", response_model=List[ServantMasterResponse])
-async def root(db: Session = Depends(get_db)):
+async def root(db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
-    query = service.get_summoned_servants()
+    query = await service.get_summoned_servants()
     response = [
         ServantMasterResponse(
             servant_name=row.servant_name,
@@ -59,18 +136,22 @@ async def root(db: Session = Depends(get_db)):
     return response
 
 
-@app.get("/top_servants", response_model=List[TopServantResponse])
-def root(db: Session = Depends(get_db)):
+@app.get(
+    "/top_servants",
+    response_model=List[TopServantResponse],
+    dependencies=[Depends(QueryBudget(1))],
+)
+async def root(db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
-    return service.get_top_servants()
+    return await service.get_top_servants()
 
 
 @app.get(
     "/female_servants_descriptions", response_model=List[ServantDescriptionResponse]
 )
-def get_female_servants_descriptions(db: Session = Depends(get_db)):
+async def get_female_servants_descriptions(db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
-    query = service.get_female_servants()
+    query = await service.get_female_servants()
     response = [
         ServantDescriptionResponse(
             servant_name=row.servant_name,
@@ -83,58 +164,256 @@ def get_female_servants_descriptions(db: Session = Depends(get_db)):
     return response
 
 
-@app.get("/level_analys", response_model=list[ClassLevelStats])
-async def root(db: Session = Depends(get_db)):
+@app.get(
+    "/level_analys",
+    response_model=list[ClassLevelStats],
+    dependencies=[Depends(QueryBudget(1))],
+)
+async def root(db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
-    results = service.get_level_analys()
+    return await service.get_level_analys()
+
+
+@app.post("/analytics/rebuild", response_model=MessageResponse)
+async def rebuild_analytics(db: AsyncSession = Depends(get_db)):
+    await AnalyticsService(db).rebuild()
+    return {"message": "rebuilt"}
+
+
+@app.get("/cache/stats", response_model=dict)
+async def get_cache_stats():
+    return catalog_cache.stats()
 
-    # Преобразование результатов в список словарей
-    class_stats = [
-        ClassLevelStats(
-            class_name=row.class_name,
-            max_level=row.max_level,
-            min_level=row.min_level,
-            avg_level=float(
-                row.avg_level
-            ),  # Преобразование в float для корректной сериализации
+
+@app.get(
+    "/catalog/snapshot",
+    response_class=Response,
+    dependencies=[Depends(QueryBudget(0))],
+)
+async def get_catalog_snapshot(request: Request, lang: Optional[str] = None):
+    # the whole catalog in one language, prebuilt and compressed; clients
+    # revalidate with If-None-Match
+    if lang:
+        languages = parse_languages(lang)
+    else:
+        languages = parse_accept_language(request.headers.get("accept-language"))
+    snapshot = catalog_snapshots.get(languages)
+    if snapshot is None:
+        raise HTTPException(
+            503, "Catalog snapshot is not built yet", headers={"Retry-After": "1"}
         )
-        for row in results
-    ]
+    return snapshot_response(request, snapshot)
+
+
+@app.get(
+    "/sync",
+    response_model=SyncResponse,
+    # the latest version, one query per entity, the servants' skills, and
+    # the tracking check on a worker's first sync
+    dependencies=[Depends(QueryBudget(9))],
+)
+async def sync_catalog(
+    since: Optional[str] = None,
+    limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=MAX_SYNC_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
+):
+    # created, updated and deleted catalog rows since the token of an
+    # earlier response; an up to date client costs one query
+    service = SyncService(db)
+    try:
+        return await service.changes(since, limit)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except SyncTokenAhead as e:
+        raise HTTPException(410, str(e))
+    except ChangeTrackingMissing as e:
+        raise HTTPException(503, str(e))
+
+
+@app.get("/catalog/snapshot/stats", response_model=dict)
+async def get_catalog_snapshot_stats():
+    return catalog_snapshots.stats()
+
+
+@app.get("/db/pool", response_model=dict)
+async def get_pool_stats():
+    return pool_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    content, media_type = metrics.render()
+    return Response(content, media_type=media_type)
 
-    return class_stats
-    quit()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    # without PROFILER_TOKEN the admin routes do not exist
+    if profiling.PROFILER_TOKEN is None:
+        raise HTTPException(404, "Not Found")
+    if x_admin_token is None or not secrets.compare_digest(
+        x_admin_token, profiling.PROFILER_TOKEN
+    ):
+        raise HTTPException(403, "Invalid admin token")
+
+
+def profiler_status(state: Optional[profiling.ProfilerState]):
+    if state is None:
+        return {"enabled": False}
+    return {
+        "enabled": state.until > time.time(),
+        "sample_rate": state.sample_rate,
+        "route": state.route,
+        "interval_ms": state.interval * 1000,
+        "started_at": datetime.fromtimestamp(state.started_at, timezone.utc),
+        "until": datetime.fromtimestamp(state.until, timezone.utc),
+    }
+
+
+@app.get(
+    "/admin/profiler",
+    response_model=ProfilerStatus,
+    dependencies=[Depends(require_admin)],
+)
+async def get_profiler():
+    return profiler_status(profiling.read_state())
+
+
+@app.post(
+    "/admin/profiler",
+    response_model=ProfilerStatus,
+    dependencies=[Depends(require_admin)],
+)
+async def start_profiler(settings: ProfilerSettings):
+    if settings.route is None and settings.sample_rate == 0:
+        raise HTTPException(400, "Set a sample_rate above 0 or a route")
+    # file writes and the sampler thread's start stay off the loop
+    state = await run_in_threadpool(
+        profiling.start,
+        settings.sample_rate,
+        settings.route,
+        settings.interval_ms / 1000,
+        settings.duration,
+    )
+    return profiler_status(state)
+
+
+@app.delete(
+    "/admin/profiler",
+    response_model=ProfilerStatus,
+    dependencies=[Depends(require_admin)],
+)
+async def stop_profiler_session():
+    return profiler_status(await run_in_threadpool(profiling.stop))
+
+
+@app.get(
+    "/admin/profiler/profile",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(require_admin)],
+)
+async def download_profile(route: Optional[str] = None):
+    content = await run_in_threadpool(profiling.collapsed, route)
+    return PlainTextResponse(
+        content,
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'},
+    )
 
 
 # Servants API -----------------------------------------------------
-@app.get("/servants", response_model=List[ServantResponse])
-async def get_all_servants(db: AsyncSession = Depends(get_db)):
+@app.get(
+    "/servants",
+    response_model=ServantPage,
+    dependencies=[Depends(QueryBudget(1))],
+)
+async def get_all_servants(
+    filters: ServantFilter = Depends(),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
     service = ServantService(db)
-    servants = await service.get_all()
-    return list(map(ServantResponse.model_validate, servants))
+    try:
+        return await service.get_all(filters, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
 
+def get_projection(
+    request: Request,
+    response: Response,
+    lang: Optional[str] = Query(None, description="comma separated, most preferred first; * for all"),
+    fields: Optional[str] = Query(None, description="comma separated localization fields"),
+) -> Optional[LocalizationProjection]:
+    # without lang, Accept-Language picks the languages
+    response.headers["Vary"] = "Accept-Language"
+    try:
+        return localization_projection(
+            lang, request.headers.get("accept-language"), fields
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
 
-@app.get("/servants_list")
-async def get_servant_list(db: AsyncSession = Depends(get_db)):
+
+@app.get(
+    "/servants_list",
+    response_model=List[ServantWithLocalization],
+    response_model_exclude_unset=True,
+    dependencies=[Depends(QueryBudget(2))],
+)
+async def get_servant_list(
+    projection: Optional[LocalizationProjection] = Depends(get_projection),
+    db: AsyncSession = Depends(get_db),
+):
     service = ServantService(db)
-    servants = await service.get_servant_list()
+    servants = await service.get_servant_list(projection)
     return servants
 
 
-@app.get("/servants")
-async def get_all_servants(db: AsyncSession = Depends(get_db)):
+@app.get("/export/servants", response_class=StreamingResponse)
+async def export_servants(format: Literal["ndjson", "csv"] = "ndjson"):
+    if format == "csv":
+        return StreamingResponse(
+            stream_csv(),
+            media_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename=servants.csv"},
+        )
+    return StreamingResponse(stream_ndjson(), media_type="application/x-ndjson")
+
+
+@app.get(
+    "/servants/{servant_id}",
+    response_model=Optional[ServantDetail],
+    response_model_exclude_unset=True,
+    dependencies=[Depends(QueryBudget(2))],
+)
+async def get_servant(
+    servant_id: int,
+    projection: Optional[LocalizationProjection] = Depends(get_projection),
+    db: AsyncSession = Depends(get_db),
+):
     service = ServantService(db)
-    servants = await service.get_all()
-    return servants
+    return await service.get_detail(servant_id, projection)
 
 
-@app.get("/servants/{servant_id}")
-async def get_servant(servant_id: int, db: AsyncSession = Depends(get_db)):
+@app.get(
+    "/servants/{servant_id}/full",
+    response_model=FullServantResponse,
+    response_model_exclude_unset=True,
+    dependencies=[Depends(QueryBudget(6))],
+)
+async def get_full_servant(
+    servant_id: int,
+    projection: Optional[LocalizationProjection] = Depends(get_projection),
+    db: AsyncSession = Depends(get_db),
+):
     service = ServantService(db)
-    servant = await service.get(servant_id)
+    servant = await service.get_full_servant(servant_id, projection)
+    if not servant:
+        raise HTTPException(404, "Servant does not exist")
     return servant
 
 
-@app.post("/servants")
+@app.post("/servants", response_model=CreatedResponse)
 async def create_servant(servant: ServantCreate, db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
     try:
@@ -144,7 +423,7 @@ async def create_servant(servant: ServantCreate, db: AsyncSession = Depends(get_
         raise HTTPException(400, str(e))
 
 
-@app.put("/servants/{servant_id}")
+@app.put("/servants/{servant_id}", response_model=MessageResponse)
 async def update_servant(
     servant_id: int, servant: ServantUpdate, db: AsyncSession = Depends(get_db)
 ):
@@ -156,7 +435,7 @@ async def update_servant(
         raise HTTPException(400, str(e))
 
 
-@app.delete("/servants/{servant_id}")
+@app.delete("/servants/{servant_id}", response_model=None)
 async def delete_servant(servant_id: int, db: AsyncSession = Depends(get_db)):
     s = ServantService(db)
     try:
@@ -165,7 +444,51 @@ async def delete_servant(servant_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(404, str(e))
 
 
-@app.get("/name/{servant_id}/{language}")
+@app.get(
+    "/servants/{servant_id}/aliases",
+    response_model=List[AliasResponse],
+    dependencies=[Depends(QueryBudget(1))],
+)
+async def get_servant_aliases(
+    servant_id: int, language: Optional[str] = None, db: AsyncSession = Depends(get_db)
+):
+    service = ServantService(db)
+    return await service.get_aliases(servant_id, language)
+
+
+@app.get(
+    "/search",
+    response_model=List[SearchResult],
+    dependencies=[Depends(QueryBudget(1))],
+)
+async def search_servants(
+    q: str = Query(..., min_length=1),
+    language: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+):
+    service = SearchService(db)
+    return await service.search(q, language, limit)
+
+
+@app.get(
+    "/search/suggest",
+    response_model=List[Suggestion],
+    dependencies=[Depends(QueryBudget(2))],
+)
+async def suggest_servants(
+    prefix: str = Query(..., min_length=1),
+    language: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50),
+    db: AsyncSession = Depends(get_db),
+):
+    # answered from memory; the session is only used when the index is stale
+    if prefix_index.stale:
+        await prefix_index.refresh(SearchService(db).load_names)
+    return prefix_index.lookup(prefix, language, limit)
+
+
+@app.get("/name/{servant_id}/{language}", response_model=Union[NameResponse, str])
 async def get_servant_name(
     servant_id: int, language: str, db: AsyncSession = Depends(get_db)
 ):
@@ -179,19 +502,36 @@ async def get_servant_name(
 # Masters API -----------------------------------------------------
 
 
-@app.get("/masters")
-async def get_all_masters(db: AsyncSession = Depends(get_db)):
+@app.get(
+    "/masters",
+    response_model=MasterPage,
+    dependencies=[Depends(QueryBudget(2))],
+)
+async def get_all_masters(
+    filters: MasterFilter = Depends(),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    embed: List[Literal["contracts"]] = Query([]),
+    db: AsyncSession = Depends(get_db),
+):
     service = MasterService(db)
-    return await service.get_all()
+    try:
+        return await service.get_all(filters, limit, cursor, "contracts" in embed)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
 
 
-@app.get("/masters/{master_id}")
+@app.get(
+    "/masters/{master_id}",
+    response_model=Optional[MasterResponse],
+    dependencies=[Depends(QueryBudget(1))],
+)
 async def get_master(master_id: int, db: AsyncSession = Depends(get_db)):
     service = MasterService(db)
     return await service.get(master_id)
 
 
-@app.post("/masters")
+@app.post("/masters", response_model=MessageResponse)
 async def create_master(
     nickname: str = Form(...),
     display_name: str = Form(...),
@@ -205,7 +545,7 @@ async def create_master(
         raise HTTPException(400, str(e))
 
 
-@app.put("/masters/{master_id}")
+@app.put("/masters/{master_id}", response_model=str)
 async def update_master(
     master_id: int,
     nickname: str = Form(...),
@@ -215,7 +555,7 @@ async def update_master(
 ):
     service = MasterService(db)
     try:
-        m = service.update(
+        m = await service.update(
             master_id,
             MasterUpdate(nickname=nickname, display_name=display_name, level=level),
         )
@@ -224,17 +564,21 @@ async def update_master(
         raise HTTPException(400, str(e))
 
 
-@app.get("/masters/{master_id}/active_count")
+@app.get(
+    "/masters/{master_id}/active_count",
+    response_model=CountResponse,
+    dependencies=[Depends(QueryBudget(1))],
+)
 async def master_contract_cound(master_id: int, db: AsyncSession = Depends(get_db)):
     service = MasterService(db)
     return {"count": await service.get_active_contracts_count(master_id)}
 
 
-@app.delete("/masters/{master_id}")
+@app.delete("/masters/{master_id}", response_model=str)
 async def delete_servant(master_id: int, db: AsyncSession = Depends(get_db)):
     service = MasterService(db)
     try:
-        service.delete(master_id)
+        await service.delete(master_id)
         return f"deleted {master_id} master"
     except ValueError as e:
         raise HTTPException(404, str(e))
@@ -243,19 +587,32 @@ async def delete_servant(master_id: int, db: AsyncSession = Depends(get_db)):
 # Contracts API -----------------------------------------------------
 
 
-@app.get("/contracts/all")
-async def root(db: AsyncSession = Depends(get_db)):
+@app.get(
+    "/contracts/all",
+    response_model=ContractPage,
+    dependencies=[Depends(QueryBudget(1))],
+)
+async def get_all_contracts(
+    filters: ContractFilter = Depends(),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    embed: List[Literal["master", "servant"]] = Query([]),
+    db: AsyncSession = Depends(get_db),
+):
     service = ContractService(db)
-    return await service.get_all()
+    try:
+        return await service.get_all(filters, limit, cursor, tuple(embed))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
 
 
-@app.get("/contracts")
+@app.get("/contracts", response_model=Optional[ContractResponse])
 async def root(servant_id: int, master_id: int, db: AsyncSession = Depends(get_db)):
     service = ContractService(db)
     return await service.get(servant_id, master_id)
 
 
-@app.post("/contracts")
+@app.post("/contracts", response_model=dict[str, ContractResponse])
 async def root(contract: ContractCreate, db: AsyncSession = Depends(get_db)):
     service = ContractService(db)
     try:
@@ -267,10 +624,18 @@ async def root(contract: ContractCreate, db: AsyncSession = Depends(get_db)):
         raise HTTPException(400, str(e))
 
 
+@app.post("/contracts/batch", response_model=ContractBatchResult)
+async def apply_contract_batch(batch: ContractBatch, db: AsyncSession = Depends(get_db)):
+    if len(batch.operations) > MAX_BATCH_SIZE:
+        raise HTTPException(400, f"At most {MAX_BATCH_SIZE} operations per batch")
+    service = ContractService(db)
+    return await service.apply_batch(batch.operations)
+
+
 @app.get("/all_localization", response_model=list[ServantLocalizationResponse])
-def root(db: AsyncSession = Depends(get_db)):
+async def root(db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
-    query = service.get_localizaions()
+    query = await service.get_localizaions()
     servant_dict = {}
     response = [
         ServantLocalizationResponse(
@@ -285,19 +650,26 @@ def root(db: AsyncSession = Depends(get_db)):
     return response
 
 
-@app.delete("/contracts")
+@app.delete("/contracts", response_model=None)
 async def root(servant_id: int, master_id: int, db: AsyncSession = Depends(get_db)):
     service = ContractService(db)
-    await service.delete(servant_id, master_id)
+    try:
+        await service.delete(servant_id, master_id)
+    except ValueError as e:
+        raise HTTPException(404, str(e))
 
 
-@app.get("/np/all")
+@app.get(
+    "/np/all",
+    response_model=List[NoblePhantasmResponse],
+    dependencies=[Depends(QueryBudget(1))],
+)
 async def root(db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
     return await service.get_all_np()
 
 
-@app.put("/np")
+@app.put("/np", response_model=None)
 async def update_noble_phantasm(
     noble_phantasm: NoblePhantasmUpdate, db: AsyncSession = Depends(get_db)
 ):
@@ -305,20 +677,24 @@ async def update_noble_phantasm(
     await service.update_np(np=noble_phantasm)
 
 
-@app.post("/np")
+@app.post("/np", response_model=None)
 async def create_noble_phantasm(
     noble_phantasm: NoblePhantasmUpdate, db: AsyncSession = Depends(get_db)
 ):
     service = ServantService(db)
     await service.create_np(np=noble_phantasm)
 
-@app.delete("/np/{id}")
+@app.delete("/np/{id}", response_model=None)
 async def delete_noble_phantasm(id: int, db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
     await service.delete_np(id)
 
 
-@app.get("/localization/{servant_id}")
+@app.get(
+    "/localization/{servant_id}",
+    response_model=Union[LocalizationResponse, list[str]],
+    dependencies=[Depends(QueryBudget(2))],
+)
 async def root(servant_id: int, language: str, db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
     # if index == None:
@@ -329,72 +705,147 @@ async def root(servant_id: int, language: str, db: AsyncSession = Depends(get_db
 
 
 
-@app.get("/skill/{servant_id}")
+@app.get(
+    "/skill/{servant_id}",
+    response_model=List[SkillResponse],
+    dependencies=[Depends(QueryBudget(3))],
+)
 async def root(servant_id: int = None, db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
-    return await service.get_skills(servant_id)
+    try:
+        return await service.get_skills(servant_id)
+    except ValueError as e:
+        raise HTTPException(404, str(e))
 
 
-@app.delete("/skills/{id}")
+@app.delete("/skills/{id}", response_model=None)
 async def root(id: int = None, db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
     return await service.delete_skill(id)
 
 
-@app.get("/skills")
+@app.get(
+    "/skills",
+    response_model=List[SkillResponse],
+    dependencies=[Depends(QueryBudget(1))],
+)
 async def root(db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
     return await service.get_all_skills()
 
 
-@app.post("/skills")
+@app.post("/skills", response_model=None)
 async def root(skill: SkillSchema, db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
 
     return await service.create_skill(skill)
 
 
-@app.put("/skills")
+@app.put("/skills", response_model=None)
 async def root(skill: SkillSchema, db: AsyncSession = Depends(get_db)):
     service = ServantService(db)
 
     return await service.update_skill(skill)
 
 
-@app.get("/skill_picture/{id}")
-async def get_image(id: int, db: AsyncSession = Depends(get_db)):
+IMMUTABLE_DIRS = (OBJECT_DIR.resolve(), media.DERIVED_DIR.resolve())
+
+
+async def image_response(
+    request: Request, source: str, width: Optional[int], format: Optional[str]
+):
+    if format is None:
+        webp = "image/webp" in request.headers.get("accept", "")
+    else:
+        webp = format == "webp"
+    # stats up to a few candidate files
+    image_path = await run_in_threadpool(media.select_variant, source, width, webp)
+    headers = {"vary": "Accept"}
+    # the bytes behind this url change on re-upload, so it must revalidate;
+    # the content-addressed url it resolved to never changes
+    url = media.public_url(image_path)
+    if url:
+        headers["content-location"] = url
+    try:
+        return await cached_file_response(
+            request, image_path, get_mime_type(image_path), headers=headers
+        )
+    except FileNotFoundError:
+        raise HTTPException(404, "image file is missing")
+
+
+@app.get("/images/{path:path}", response_class=FileResponse)
+async def get_immutable_image(path: str, request: Request):
+    file_path = Path("media") / path
+    if not any(file_path.resolve().is_relative_to(root) for root in IMMUTABLE_DIRS):
+        raise HTTPException(404, "Not found")
+    try:
+        return await cached_file_response(
+            request, str(file_path), get_mime_type(path), cache_control=IMMUTABLE
+        )
+    except FileNotFoundError:
+        raise HTTPException(404, "Not found")
+
+
+@app.get(
+    "/skill_picture/{id}",
+    response_class=FileResponse,
+    dependencies=[Depends(QueryBudget(1))],
+)
+async def get_image(
+    id: int,
+    request: Request,
+    width: Optional[int] = Query(None, ge=1, le=4096),
+    format: Optional[Literal["webp", "original"]] = None,
+    db: AsyncSession = Depends(get_db),
+):
     service = ServantService(db)
     try:
         image_path = await service.get_skill_icon(id)
-        return FileResponse(image_path, media_type=get_mime_type(image_path))
+        return await image_response(request, image_path, width, format)
 
     except ValueError as e:
 
         raise HTTPException(404, str(e))
 
 
-@app.post("/add_skill_picture/{id}")
+async def store_upload(file: UploadFile, check_type: bool = True) -> StoredFile:
+    suffix = Path(file.filename).suffix
+    if check_type:
+        get_mime_type(file.filename)
+    try:
+        stored = await save_file_to_disk(file, suffix)
+    except UploadTooLarge as e:
+        raise HTTPException(413, str(e))
+    metrics.record_upload(stored.size)
+    return stored
+
+
+@app.post("/add_skill_picture/{id}", response_model=MessageResponse)
 async def root(
     id: int, file: UploadFile = File(...), db: AsyncSession = Depends(get_db)
 ):
     service = ServantService(db)
 
-    picture_path = SKILL_DIR / f"skill_{id}_icon{Path(file.filename).suffix}"
-    saved_path = save_file_to_disk(file, picture_path)
-    service.add_skill_picture(id, saved_path)
+    stored = await store_upload(file)
+    await service.add_skill_picture(id, stored.path)
     message = {"message": "success"}
     return message
 
 
-@app.post("/upload/")
+@app.post("/upload/", response_model=UploadResponse)
 async def upload_file(file: UploadFile = File(...)):
-
-    with open(file.filename, "wb") as buffer:
-        buffer.write(await file.read())
-    return {"filename": file.filename, "message": "File uploaded successfully"}
+    stored = await store_upload(file, check_type=False)
+    return {
+        "filename": file.filename,
+        "path": stored.path,
+        "sha256": stored.digest,
+        "size": stored.size,
+        "message": "File uploaded successfully",
+    }
 
 
-@app.post("/servants/{servant_id}/pictures/")
+@app.post("/servants/{servant_id}/pictures/", response_model=PictureUploadResponse)
 async def add_servant_picture(
     servant_id: int,
     grade: int = Form(...),
@@ -402,17 +853,15 @@ async def add_servant_picture(
     db: AsyncSession = Depends(get_db),
 ):
     service = ServantService(db)
-    servant = service.get(servant_id)
+    servant = await service.get(servant_id)
     if not servant:
         raise HTTPException(status_code=404, detail="Servant not found")
 
-    picture_path = (
-        MEDIA_DIR / str(servant_id) / f"asc{grade}{Path(file.filename).suffix}"
-    )
-
+    stored = await store_upload(file)
     try:
-        saved_path = save_file_to_disk(file, picture_path)
-        picture: ServantPicture = service.add_picture(servant_id, grade, saved_path)
+        picture: ServantPicture = await service.add_picture(
+            servant_id, grade, stored.path
+        )
         return {
             "id": picture.servant_id,
             "grade": picture.grade,
@@ -422,30 +871,29 @@ async def add_servant_picture(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/servants_new")
+@app.post("/servants_new", response_model=ServantWithPictureResponse)
 async def add_servant(
     name: str = Form(...),
     class_name: str = Form(...),
     gender: str = Form(...),
     alignment: str = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     service = ServantService(db)
     message: str
+    stored = await store_upload(file)
     try:
-        new_servant = service.create(
+        new_servant = await service.create(
             ServantCreate(
                 name=name, class_name=class_name, gender=gender, alignment=alignment
             )
         )
-        picture_path = (
-            MEDIA_DIR / str(new_servant.id) / f'asc{"1"}{Path(file.filename).suffix}'
-        )
 
         try:
-            saved_path = save_file_to_disk(file, picture_path)
-            picture: ServantPicture = service.add_picture(new_servant.id, 1, saved_path)
+            picture: ServantPicture = await service.add_picture(
+                new_servant.id, 1, stored.path
+            )
             message = {
                 "id": picture.servant_id,
                 "grade": picture.grade,
@@ -462,16 +910,17 @@ async def add_servant(
         raise HTTPException(400, str(e))
 
 
-@app.post("/add_image/{servant_id}")
+@app.post("/add_image/{servant_id}", response_model=PictureUploadResponse)
 async def add_image(
     servant_id: int, file: UploadFile = File(...), db: AsyncSession = Depends(get_db)
 ):
     service = ServantService(db)
-    servant = service.get(servant_id)
+    servant = await service.get(servant_id)
+    if not servant:
+        raise HTTPException(status_code=404, detail="Servant not found")
 
-    picture_path = MEDIA_DIR / str(servant.id) / f'asc{"1"}{Path(file.filename).suffix}'
-    saved_path = save_file_to_disk(file, picture_path)
-    picture: ServantPicture = service.add_picture(servant.id, 1, saved_path)
+    stored = await store_upload(file)
+    picture: ServantPicture = await service.add_picture(servant.id, 1, stored.path)
     message = {
         "id": picture.servant_id,
         "grade": picture.grade,
@@ -480,19 +929,51 @@ async def add_image(
     return message
 
 
-@app.get("/get_image")
-async def get_image(servant_id: int, grade: int, db: AsyncSession = Depends(get_db)):
+@app.get(
+    "/get_image",
+    response_class=FileResponse,
+    dependencies=[Depends(QueryBudget(1))],
+)
+async def get_image(
+    servant_id: int,
+    grade: int,
+    request: Request,
+    width: Optional[int] = Query(None, ge=1, le=4096),
+    format: Optional[Literal["webp", "original"]] = None,
+    db: AsyncSession = Depends(get_db),
+):
     service = ServantService(db)
     try:
         image_path = await service.get_picture(servant_id, grade)
-        return FileResponse(image_path, media_type=get_mime_type(image_path))
+        return await image_response(request, image_path, width, format)
 
     except ValueError as e:
 
         raise HTTPException(404, str(e))
 
 
-@app.post("/localization")
+@app.get(
+    "/pictures",
+    response_model=PictureBatch,
+    dependencies=[Depends(QueryBudget(2))],
+)
+async def get_picture_batch(
+    servant_id: Optional[List[int]] = Query(None),
+    filters: ServantFilter = Depends(),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    if servant_id is not None and len(servant_id) > MAX_PAGE_SIZE:
+        raise HTTPException(400, f"At most {MAX_PAGE_SIZE} servant ids per request")
+    service = ServantService(db)
+    try:
+        return await service.get_picture_batch(servant_id, filters, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+@app.post("/localization", response_model=None)
 async def root(
     servant_id: int,
     language: str,
@@ -508,7 +989,7 @@ async def root(
 ):
 
     service = ServantService(db)
-    service.add_localization(
+    await service.add_localization(
         language=language,
         servant_id=servant_id,
         name=name,
@@ -522,7 +1003,7 @@ async def root(
     )
 
 
-@app.put("/localization")
+@app.put("/localization", response_model=None)
 async def update_localization(
     servant_id: int,
     language: str,
@@ -536,11 +1017,28 @@ async def update_localization(
     )
 
 
+@app.post("/import", response_model=ImportResult)
+async def import_catalog(request: Request, db: AsyncSession = Depends(get_db)):
+    service = ImportService(db)
+    errors = []
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        rows = await service.from_ndjson(request.stream(), errors)
+    else:
+        try:
+            payload = CatalogImport.model_validate_json(await request.body())
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        rows = service.from_json(payload)
+    return await service.run(rows, errors)
+
+
 def get_mime_type(file_path: str) -> str:
     ext = os.path.splitext(file_path)[-1].lower()
     if ext == ".jpg" or ext == ".jpeg":
         return "image/jpeg"
     elif ext == ".png":
         return "image/png"
+    elif ext == ".webp":
+        return "image/webp"
     else:
         raise HTTPException(status_code=400, detail="Unsupported file type")
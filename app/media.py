@@ -0,0 +1,166 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DERIVED_DIR = Path("media") / "derived"
+DERIVATIVE_WIDTHS = tuple(
+    sorted(int(width) for width in os.getenv("IMAGE_WIDTHS", "128,256,512").split(","))
+)
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", 80))
+IMAGE_INFO_CACHE_SIZE = int(os.getenv("IMAGE_INFO_CACHE_SIZE", 4096))
+
+PIL_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}
+DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+_pool = None
+_pending = set()
+
+
+class ImageInfo(NamedTuple):
+    width: int | None
+    height: int | None
+    digest: str
+    size: int
+
+
+def content_digest(source: str) -> str | None:
+    # only content-addressed uploads get derivatives; legacy paths such as
+    # media/servants/1/asc1.png would collide between servants
+    digest = Path(source).stem
+    return digest if DIGEST.match(digest) else None
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_info(path: str, stat_result: os.stat_result | None = None) -> ImageInfo:
+    # blocking; remembered per path until the file's mtime or size changes.
+    # content-addressed files carry their hash in the name, anything else
+    # (pre-dedup uploads) is hashed once
+    if stat_result is None:
+        stat_result = os.stat(path)
+    return _read_image_info(path, stat_result.st_mtime_ns, stat_result.st_size)
+
+
+@functools.lru_cache(maxsize=IMAGE_INFO_CACHE_SIZE)
+def _read_image_info(path: str, mtime_ns: int, size: int) -> ImageInfo:
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+    except OSError:
+        width = height = None
+    digest = content_digest(path) or _hash_file(path)
+    return ImageInfo(width, height, digest, size)
+
+
+def public_url(path: str) -> str | None:
+    # immutable url for content-addressed files and their variants
+    if content_digest(path) or Path(path).parent.parent.parent == DERIVED_DIR:
+        return "/images/" + Path(path).relative_to("media").as_posix()
+    return None
+
+
+def variant_path(source: str, width: int | None, suffix: str) -> Path:
+    # a variant is addressed by its source's hash plus the resize parameters,
+    # so it never changes once written
+    digest = content_digest(source)
+    name = f"w{width}" if width else "full"
+    return DERIVED_DIR / digest[:2] / digest / f"{name}{suffix}"
+
+
+def _save(image: Image.Image, path: Path, suffix: str):
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".part")
+    options = {"quality": WEBP_QUALITY} if suffix == ".webp" else {}
+    if PIL_FORMATS[suffix] == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    image.save(tmp_path, PIL_FORMATS[suffix], **options)
+    os.replace(tmp_path, path)
+
+
+def build_derivatives(source: str) -> list[str]:
+    # runs in a worker process
+    suffix = Path(source).suffix.lower()
+    built = []
+    with Image.open(source) as original:
+        original.load()
+        targets = [(None, original)]
+        for width in DERIVATIVE_WIDTHS:
+            if width >= original.width:
+                break
+            height = max(1, round(original.height * width / original.width))
+            targets.append((width, original.resize((width, height), Image.LANCZOS)))
+        for width, image in targets:
+            for variant_suffix in {".webp", suffix}:
+                if width is None and variant_suffix == suffix:
+                    continue
+                path = variant_path(source, width, variant_suffix)
+                if not path.exists():
+                    _save(image, path, variant_suffix)
+                built.append(str(path))
+    return built
+
+
+def _finished(future):
+    _pending.discard(future)
+    if not future.cancelled() and future.exception():
+        logger.warning("image derivatives failed: %s", future.exception())
+
+
+def schedule_derivatives(source: str):
+    global _pool
+    if content_digest(source) is None or Path(source).suffix.lower() not in PIL_FORMATS:
+        return
+    if _pool is None:
+        # spawn, not fork: the worker has a running loop and open connections
+        _pool = ProcessPoolExecutor(
+            IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    future = asyncio.get_running_loop().run_in_executor(
+        _pool, build_derivatives, source
+    )
+    _pending.add(future)
+    future.add_done_callback(_finished)
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def select_variant(source: str, width: int | None, webp: bool) -> str:
+    # the smallest pre-built variant at least as wide as asked for, falling
+    # back to the full-size webp or the original while variants are pending
+    if content_digest(source) is None:
+        return source
+    suffix = ".webp" if webp else Path(source).suffix.lower()
+    if width:
+        for candidate in DERIVATIVE_WIDTHS:
+            if candidate >= width:
+                path = variant_path(source, candidate, suffix)
+                if path.exists():
+                    return str(path)
+    if webp:
+        path = variant_path(source, None, suffix)
+        if path.exists():
+            return str(path)
+    return source
@@ -0,0 +1,167 @@
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+from .cache import catalog_cache
+from .database import pool_stats
+from .instrumentation import current_query_stats
+
+# set by gunicorn.conf.py / the Dockerfile; every worker then writes its samples
+# to mmap files there and a scrape of any worker sums them
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+SYNC_INTERVAL = float(os.getenv("METRICS_SYNC_INTERVAL", 1))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time to serve a request, by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent in SQL statements per request",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_QUERIES = Counter(
+    "http_request_db_queries_total",
+    "SQL statements run while serving requests",
+    ["method", "route"],
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests being served",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+UPLOAD_BYTES = Counter("upload_bytes_total", "Bytes received in file uploads")
+UPLOADS = Counter("uploads_total", "File uploads stored")
+IMAGE_BYTES = Counter(
+    "image_bytes_served_total", "Image bytes sent", ["kind", "status"]
+)
+IMAGE_RESPONSES = Counter(
+    "image_responses_total", "Image responses", ["kind", "status"]
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Connections per pool and state",
+    ["pool", "state"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Pool checkouts", ["pool"])
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Pool checkout timeouts", ["pool"])
+DB_POOL_WAIT = Counter(
+    "db_pool_wait_seconds_total", "Time spent waiting for a connection", ["pool"]
+)
+CACHE_REQUESTS = Counter(
+    "catalog_cache_requests_total", "Catalog cache lookups", ["entity", "result"]
+)
+CACHE_SIZE = Gauge(
+    "catalog_cache_entries", "Entries in the catalog cache", multiprocess_mode="livesum"
+)
+
+_synced_at = 0.0
+_last: dict[tuple, float] = {}
+
+
+def _advance(counter, labels: tuple, value: float):
+    # the pool and cache keep running totals; counters only take increments
+    key = (counter, *labels)
+    delta = value - _last.get(key, 0)
+    if delta > 0:
+        counter.labels(*labels).inc(delta)
+    _last[key] = value
+
+
+def sync_stats(force: bool = False):
+    global _synced_at
+    now = time.monotonic()
+    if not force and now - _synced_at < SYNC_INTERVAL:
+        return
+    _synced_at = now
+    stats = pool_stats()
+    pools = [("primary", stats["primary"])]
+    pools += [(replica["url"], replica) for replica in stats["replicas"]]
+    for name, pool in pools:
+        DB_POOL_CONNECTIONS.labels(name, "checked_out").set(pool["checked_out"])
+        DB_POOL_CONNECTIONS.labels(name, "checked_in").set(pool["checked_in"])
+        DB_POOL_CONNECTIONS.labels(name, "overflow").set(pool["overflow"])
+        _advance(DB_POOL_CHECKOUTS, (name,), pool["checkouts"])
+        _advance(DB_POOL_TIMEOUTS, (name,), pool["timeouts"])
+        _advance(DB_POOL_WAIT, (name,), pool["wait_time_total"])
+    cache = catalog_cache.stats()
+    CACHE_SIZE.set(cache["size"])
+    for entity, counts in cache["entities"].items():
+        _advance(CACHE_REQUESTS, (entity, "hit"), counts["hits"])
+        _advance(CACHE_REQUESTS, (entity, "miss"), counts["misses"])
+
+
+def record_upload(size: int):
+    UPLOADS.inc()
+    UPLOAD_BYTES.inc(size)
+
+
+def record_image(kind: str, status: int, size: int):
+    IMAGE_RESPONSES.labels(kind, status).inc()
+    IMAGE_BYTES.labels(kind, status).inc(size)
+
+
+def render() -> tuple[bytes, str]:
+    sync_stats(force=True)
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    # sits inside QueryStatsMiddleware so the request's query stats are
+    # still current when it records them
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method = scope["method"]
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = IN_PROGRESS.labels(method)
+        in_progress.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_progress.dec()
+            # the template, not the raw path, keeps label cardinality bounded
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            REQUEST_DURATION.labels(method, template, status).observe(
+                time.perf_counter() - started
+            )
+            stats = current_query_stats()
+            if stats is not None:
+                REQUEST_DB_DURATION.labels(method, template).observe(stats.db_time)
+                if stats.queries:
+                    REQUEST_DB_QUERIES.labels(method, template).inc(stats.queries)
+            sync_stats()
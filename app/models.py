@@ -1,8 +1,14 @@
 from typing import List
-from sqlalchemy import Integer, String, ForeignKey, DateTime, Text
+from sqlalchemy import BigInteger, Integer, String, ForeignKey, DateTime, Text, Float, Index, FetchedValue
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from .database import Base
 
+
+def row_version_column():
+    # set from one counter shared by the catalog tables by the triggers of
+    # migration 0004, on every insert and update; GET /sync reads it
+    return mapped_column(BigInteger, nullable=False, server_default='0', server_onupdate=FetchedValue())
+
 class Master(Base):
     __tablename__ = "master"
     id : Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -18,6 +24,10 @@ class Master(Base):
 
 class Servant(Base):
     __tablename__ = "servant"
+    __table_args__ = (
+        Index("ix_servant_class_level", "class", "level"),
+        Index("ix_servant_row_version", "row_version"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     class_name: Mapped[str] = mapped_column("class", String, nullable=False)
     name: Mapped[str] = mapped_column(String, nullable=False)
@@ -26,6 +36,7 @@ class Servant(Base):
     state : Mapped[str] = mapped_column(String, server_default='')
     alignment : Mapped[str] = mapped_column(String)
     gender : Mapped[int] = mapped_column(String)
+    row_version : Mapped[int] = row_version_column()
     
     noble_phantasm : Mapped["NoblePhantasm"] = relationship("NoblePhantasm", back_populates="servant", cascade="all, delete-orphan")
     localizations : Mapped[List["ServantLocalization"]] = relationship("ServantLocalization", back_populates="servant", cascade="all, delete-orphan")
@@ -41,14 +52,17 @@ class Servant(Base):
 
 class ServantPicture(Base):
     __tablename__ = "servant_picture"
+    __table_args__ = (Index("ix_servant_picture_row_version", "row_version"),)
     servant_id : Mapped[int] = mapped_column(Integer, ForeignKey("servant.id"), primary_key=True)
     grade : Mapped[int] = mapped_column(Integer, primary_key=True)
     picture : Mapped[str] = mapped_column(String)
+    row_version : Mapped[int] = row_version_column()
     servant : Mapped["Servant"] = relationship("Servant", back_populates="pictures")
 
     
 class Alias(Base):
     __tablename__ = "alias"
+    __table_args__ = (Index("ix_alias_servant_language", "servant_id", "language_code"),)
     id : Mapped[int] = mapped_column(Integer, primary_key=True)
     language_code : Mapped[str] = mapped_column(String, nullable=False)
     name : Mapped[str] = mapped_column(String, nullable=False)
@@ -57,16 +71,26 @@ class Alias(Base):
 
 class NoblePhantasm(Base):
     __tablename__ = "noble_phantasm"
+    __table_args__ = (Index("ix_noble_phantasm_row_version", "row_version"),)
     servant_id : Mapped[int] = mapped_column(Integer, ForeignKey("servant.id"), primary_key=True)
     rank : Mapped[str] = mapped_column(String)
     activation_type : Mapped[str] = mapped_column("type", String)
     name : Mapped[str] = mapped_column(String)
     description : Mapped[str] = mapped_column(Text)
+    row_version : Mapped[int] = row_version_column()
     servant : Mapped["Servant"]= relationship("Servant", back_populates="noble_phantasm")
 
     
+# Contract.status values; a servant has at most one active contract
+CONTRACT_ACTIVE = "active"
+CONTRACT_TERMINATED = "terminated"
+
 class Contract(Base):
     __tablename__ = "contract"
+    __table_args__ = (
+        Index("ix_contract_master_status", "master_id", "status"),
+        Index("ix_contract_servant_master", "servant_id", "master_id"),
+    )
     master_id : Mapped[int] = mapped_column(Integer, ForeignKey("master.id"), primary_key=True)
     servant_id : Mapped[int] = mapped_column(Integer, ForeignKey("servant.id"), primary_key=True)
     status : Mapped[str] = mapped_column(String, server_default='')
@@ -78,6 +102,11 @@ class Contract(Base):
     
 class ServantLocalization(Base):
     __tablename__ = 'servant_localization'
+    # covering on PostgreSQL, so name lookups by (servant_id, language) skip the heap
+    __table_args__ = (
+        Index("uq_servant_localization_servant_language", "servant_id", "language", unique=True, postgresql_include=["name"]),
+        Index("ix_servant_localization_row_version", "row_version"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     language: Mapped[str] = mapped_column(String, nullable=False)
@@ -89,11 +118,13 @@ class ServantLocalization(Base):
     voice_actor: Mapped[str] = mapped_column(Text)
     temper: Mapped[str] = mapped_column(Text)
     intro : Mapped[str] = mapped_column(Text)
+    row_version : Mapped[int] = row_version_column()
     servant_id: Mapped[int] = mapped_column(Integer, ForeignKey('servant.id'), nullable=False)
     servant: Mapped["Servant"] = relationship("Servant", back_populates="localizations")
     
 class Skill(Base):
     __tablename__ = "skill"
+    __table_args__ = (Index("ix_skill_row_version", "row_version"),)
     id : Mapped[int] = mapped_column(Integer, primary_key=True)
     skill_type : Mapped[str] = mapped_column("type", String)
     servants : Mapped[List["ServantSkill"]] = relationship("ServantSkill", back_populates="skill")
@@ -101,12 +132,41 @@ class Skill(Base):
     name : Mapped[str] = mapped_column(String)
     description : Mapped[str] = mapped_column(Text)
     icon : Mapped[str] = mapped_column(String)
+    row_version : Mapped[int] = row_version_column()
     def __str__(self):
         return self.skill_type
     
 class ServantSkill(Base):
     __tablename__ = "servant_skill"
+    __table_args__ = (Index("ix_servant_skill_skill", "skill_id"),)
     servant_id : Mapped[int] = mapped_column(Integer, ForeignKey("servant.id"), primary_key=True)
     skill_id : Mapped[int] = mapped_column(Integer, ForeignKey("skill.id"), primary_key=True)
     servant : Mapped["Servant"] = relationship("Servant", back_populates="skills")
-    skill : Mapped["Skill"] = relationship("Skill", back_populates="servants")
\ No newline at end of file
+    skill : Mapped["Skill"] = relationship("Skill", back_populates="servants")
+
+
+class ClassLevelSummary(Base):
+    __tablename__ = "class_level_summary"
+    class_name : Mapped[str] = mapped_column("class", String, primary_key=True)
+    servant_count : Mapped[int] = mapped_column(Integer, nullable=False)
+    max_level : Mapped[int] = mapped_column(Integer)
+    min_level : Mapped[int] = mapped_column(Integer)
+    avg_level : Mapped[float] = mapped_column(Float)
+
+
+class MasterTopServant(Base):
+    __tablename__ = "master_top_servant"
+    master_id : Mapped[int] = mapped_column(Integer, ForeignKey("master.id", ondelete="CASCADE"), primary_key=True)
+    rank : Mapped[int] = mapped_column(Integer, primary_key=True)
+    servant_id : Mapped[int] = mapped_column(Integer, ForeignKey("servant.id", ondelete="CASCADE"), nullable=False)
+    servant_level : Mapped[int] = mapped_column(Integer)
+
+
+class SyncTombstone(Base):
+    # one row per deleted catalog row, written by the delete triggers of
+    # migration 0004 with the next row version; entity_key is the JSON of
+    # the deleted row's primary key
+    __tablename__ = "sync_tombstone"
+    row_version : Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    entity : Mapped[str] = mapped_column(String, nullable=False)
+    entity_key : Mapped[str] = mapped_column(String, nullable=False)
@@ -0,0 +1,248 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import NamedTuple
+
+PROFILER_DIR = Path(os.getenv("PROFILER_DIR", "/tmp/fgp-profiler"))
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN")
+RELOAD_INTERVAL = 1.0
+FLUSH_INTERVAL = 2.0
+MAX_DEPTH = 128
+
+STATE_FILE = PROFILER_DIR / "state.json"
+
+
+class ProfilerState(NamedTuple):
+    sample_rate: float
+    route: str | None
+    interval: float
+    started_at: float
+    until: float
+
+
+class Sampler:
+    # One per worker. While profiling is on, a thread snapshots the event loop
+    # thread's stack every interval; a sample counts when the stack passes
+    # through the frame of a request picked by ProfilerMiddleware, and is
+    # filed under that request's route template.
+    def __init__(self):
+        self.state: ProfilerState | None = None
+        self.requests: dict = {}
+        self.counts: Counter = Counter()
+        self.session = None
+        # guards requests and counts, shared with the sampling thread
+        self._lock = threading.Lock()
+        # serializes apply(), which runs on the loop and in the thread pool
+        self._control = threading.Lock()
+        self._thread = None
+        self._stopping = None
+        self._checked_at = 0.0
+        self._mtime = None
+
+    def reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            mtime = STATE_FILE.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self.apply(read_state())
+        elif self.state is not None and time.time() > self.state.until:
+            self.apply(None)
+
+    def apply(self, state: ProfilerState | None):
+        with self._control:
+            if state is not None and time.time() > state.until:
+                state = None
+            self.state = state
+            if state is None:
+                self.stop()
+                return
+            if state.started_at != self.session:
+                with self._lock:
+                    self.session = state.started_at
+                    self.counts = Counter()
+            if self._thread is None:
+                # each thread gets its own event, so a stopping thread can't
+                # miss its signal when a new one starts right after
+                self._stopping = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run,
+                    args=(self._stopping,),
+                    name="profiler",
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def stop(self):
+        # doesn't wait: the thread flushes once more on its way out
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread = None
+        else:
+            self.flush()
+
+    def join(self):
+        # stop and wait for the last flush; blocks, so not on the loop
+        thread = self._thread
+        self.stop()
+        if thread is not None:
+            thread.join()
+
+    def picks(self, scope) -> bool:
+        state = self.state
+        if state is None:
+            return False
+        # route-filtered profiles keep every request; the template is only
+        # known after routing, so samples are filtered instead
+        return state.route is not None or random.random() < state.sample_rate
+
+    def _run(self, stopping: threading.Event):
+        flushed_at = time.monotonic()
+        while not stopping.wait(self.state.interval if self.state else 0.01):
+            if self.requests:
+                self.sample()
+            if time.monotonic() - flushed_at >= FLUSH_INTERVAL:
+                self.flush()
+                flushed_at = time.monotonic()
+        self.flush()
+
+    def enter(self, frame, scope):
+        with self._lock:
+            self.requests[frame] = (threading.get_ident(), scope)
+
+    def leave(self, frame):
+        with self._lock:
+            del self.requests[frame]
+
+    def sample(self):
+        # the loop thread adds and removes requests while this runs
+        with self._lock:
+            requests = dict(self.requests)
+        frames = sys._current_frames()
+        for thread_id in {thread_id for thread_id, _ in requests.values()}:
+            frame = frames.get(thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                request = requests.get(frame)
+                if request is not None:
+                    self._count(request[1], stack)
+                    break
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+                )
+                frame = frame.f_back
+
+    def _count(self, scope: dict, stack: list[str]):
+        route = getattr(scope.get("route"), "path", None) or "unmatched"
+        state = self.state
+        if state is None or (state.route is not None and route != state.route):
+            return
+        stack.append(f"{scope['method']} {route}")
+        with self._lock:
+            self.counts[";".join(reversed(stack))] += 1
+
+    def flush(self):
+        with self._lock:
+            if not self.counts:
+                return
+            lines = "".join(
+                f"{stack} {count}\n" for stack, count in self.counts.items()
+            )
+            path = samples_path(self.session, os.getpid())
+        PROFILER_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".part")
+        tmp_path.write_text(lines)
+        os.replace(tmp_path, path)
+
+
+sampler = Sampler()
+
+
+def samples_path(session: float, pid) -> Path:
+    return PROFILER_DIR / f"samples-{int(session * 1000)}-{pid}.txt"
+
+
+def write_state(state: ProfilerState):
+    PROFILER_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = STATE_FILE.with_suffix(".part")
+    tmp_path.write_text(json.dumps(state._asdict()))
+    os.replace(tmp_path, STATE_FILE)
+
+
+def read_state() -> ProfilerState | None:
+    try:
+        return ProfilerState(**json.loads(STATE_FILE.read_text()))
+    except (FileNotFoundError, ValueError, TypeError):
+        return None
+
+
+def start(
+    sample_rate: float, route: str | None, interval: float, duration: float
+) -> ProfilerState:
+    # only one session's samples are kept
+    for path in PROFILER_DIR.glob("samples-*.txt"):
+        path.unlink(missing_ok=True)
+    now = time.time()
+    state = ProfilerState(sample_rate, route, interval, now, now + duration)
+    write_state(state)
+    sampler.apply(state)
+    return state
+
+
+def stop() -> ProfilerState | None:
+    # the state file stays behind, expired, so the last profile can still be
+    # downloaded; other workers stop on their next reload
+    state = read_state()
+    if state is not None and state.until > time.time():
+        state = state._replace(until=time.time())
+        write_state(state)
+    sampler.apply(None)
+    return state
+
+
+def collapsed(route: str | None = None) -> str:
+    # every worker's samples from the last session, merged; the format
+    # flamegraph.pl and speedscope read
+    state = read_state()
+    if state is None:
+        return ""
+    sampler.flush()
+    totals: Counter = Counter()
+    for path in PROFILER_DIR.glob(samples_path(state.started_at, "*").name):
+        for line in path.read_text().splitlines():
+            stack, _, count = line.rpartition(" ")
+            if route is None or stack.split(";", 1)[0].split(" ", 1)[-1] == route:
+                totals[stack] += int(count)
+    return "".join(f"{stack} {count}\n" for stack, count in totals.most_common())
+
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            sampler.reload()
+            if sampler.state is not None and sampler.picks(scope):
+                return await self._profiled(scope, receive, send)
+        return await self.app(scope, receive, send)
+
+    async def _profiled(self, scope, receive, send):
+        # this frame marks where a sampled stack stops belonging to the server
+        frame = sys._getframe()
+        sampler.enter(frame, scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            sampler.leave(frame)
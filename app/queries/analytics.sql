@@ -0,0 +1,42 @@
+-- Summary tables behind /level_analys and /top_servants.
+-- The services keep them current as servants and contracts change;
+-- this script creates and fully (re)populates them.
+CREATE TABLE IF NOT EXISTS class_level_summary (
+    class VARCHAR PRIMARY KEY,
+    servant_count INTEGER NOT NULL,
+    max_level INTEGER,
+    min_level INTEGER,
+    avg_level DOUBLE PRECISION
+);
+
+CREATE TABLE IF NOT EXISTS master_top_servant (
+    master_id INTEGER NOT NULL REFERENCES master (id) ON DELETE CASCADE,
+    rank INTEGER NOT NULL,
+    servant_id INTEGER NOT NULL REFERENCES servant (id) ON DELETE CASCADE,
+    servant_level INTEGER,
+    PRIMARY KEY (master_id, rank)
+);
+
+BEGIN;
+
+DELETE FROM class_level_summary;
+INSERT INTO class_level_summary (class, servant_count, max_level, min_level, avg_level)
+SELECT class, count(*), max(level), min(level), avg(level)
+FROM servant
+GROUP BY class;
+
+DELETE FROM master_top_servant;
+INSERT INTO master_top_servant (master_id, rank, servant_id, servant_level)
+SELECT master_id, rank, servant_id, level
+FROM (
+    SELECT
+        contract.master_id,
+        servant.id AS servant_id,
+        servant.level,
+        row_number() OVER (PARTITION BY contract.master_id ORDER BY servant.level DESC) AS rank
+    FROM contract
+    JOIN servant ON servant.id = contract.servant_id
+) ranked
+WHERE rank <= 3;
+
+COMMIT;
@@ -0,0 +1,4 @@
+-- Conflict target for localization upserts in POST /import.
+-- Fails if a servant already has two rows for one language; merge those first.
+CREATE UNIQUE INDEX IF NOT EXISTS uq_servant_localization_servant_language
+    ON servant_localization (servant_id, language);
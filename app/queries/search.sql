@@ -0,0 +1,20 @@
+-- Indexes behind GET /search. The tsvector expressions must match the ones
+-- built in SearchService.search exactly, or the planner will not use them.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_servant_name_trgm
+    ON servant USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_servant_name_fts
+    ON servant USING gin (to_tsvector('simple', name));
+
+CREATE INDEX IF NOT EXISTS ix_alias_name_trgm
+    ON alias USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_alias_name_fts
+    ON alias USING gin (to_tsvector('simple', name));
+
+CREATE INDEX IF NOT EXISTS ix_servant_localization_name_trgm
+    ON servant_localization USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_servant_localization_fts
+    ON servant_localization USING gin (
+        to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))
+    );
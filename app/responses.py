@@ -0,0 +1,182 @@
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+import anyio
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+
+from .media import DERIVED_DIR, content_digest, image_info
+from .metrics import record_image
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, no-cache"
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+async def file_etag(path: str, stat_result: os.stat_result) -> str:
+    source = Path(path)
+    if content_digest(path):
+        return f'"{source.stem}"'
+    if source.parent.parent.parent == DERIVED_DIR:
+        # w128.webp and w128.png share a url behind Vary: Accept, so the
+        # format is part of the validator
+        return f'"{source.parent.name}-{source.stem}{source.suffix}"'
+    info = await run_in_threadpool(image_info, path, stat_result)
+    return f'"{info.digest}"'
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+    return False
+
+
+def _byte_range(request: Request, etag: str, size: int) -> tuple[int, int] | None:
+    header = request.headers.get("range")
+    if not header:
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        return None
+    match = RANGE.match(header.strip())
+    if match is None:
+        # multiple or non-byte ranges: ignore and send the whole file
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        start = max(size - int(last), 0)
+        end = size - 1
+    else:
+        return None
+    if start > end or start >= size:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+class PartialFileResponse(FileResponse):
+    def __init__(self, path: str, start: int, end: int, **kwargs):
+        super().__init__(path, status_code=206, **kwargs)
+        self.start = start
+        self.end = end
+        size = kwargs["stat_result"].st_size
+        self.headers["content-length"] = str(end - start + 1)
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+    async def __call__(self, scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": remaining > 0,
+                    }
+                )
+        if remaining:
+            await send({"type": "http.response.body", "body": b""})
+
+
+async def cached_file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    cache_control: str = REVALIDATE,
+    headers: dict | None = None,
+) -> Response:
+    stat_result = await anyio.Path(path).stat()
+    etag = await file_etag(path, stat_result)
+    kind = "variant" if Path(path).parent.parent.parent == DERIVED_DIR else "original"
+    headers = {
+        **(headers or {}),
+        "etag": etag,
+        "cache-control": cache_control,
+        "accept-ranges": "bytes",
+    }
+    if _not_modified(request, etag, stat_result.st_mtime):
+        headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        record_image(kind, 304, 0)
+        return Response(status_code=304, headers=headers)
+    try:
+        byte_range = _byte_range(request, etag, stat_result.st_size)
+    except RangeNotSatisfiable:
+        headers["content-range"] = f"bytes */{stat_result.st_size}"
+        record_image(kind, 416, 0)
+        return Response(status_code=416, headers=headers)
+    options = dict(media_type=media_type, headers=headers, stat_result=stat_result)
+    if byte_range is None:
+        record_image(kind, 200, stat_result.st_size)
+        return FileResponse(path, **options)
+    record_image(kind, 206, byte_range[1] - byte_range[0] + 1)
+    return PartialFileResponse(path, *byte_range, **options)
+
+
+def accepted_encodings(request: Request) -> set[str]:
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def snapshot_response(request: Request, snapshot) -> Response:
+    # the body is already compressed, in every coding, so this only picks one
+    accepted = accepted_encodings(request)
+    coding = next(
+        (
+            coding
+            for coding in ("br", "gzip")
+            if coding in snapshot.encoded and (coding in accepted or "*" in accepted)
+        ),
+        "identity",
+    )
+    etag = snapshot.etag(coding)
+    headers = {
+        "etag": etag,
+        "cache-control": REVALIDATE,
+        "vary": "Accept-Encoding, Accept-Language",
+        "content-language": snapshot.language,
+    }
+    if _not_modified(request, etag, snapshot.built_at):
+        return Response(status_code=304, headers=headers)
+    if coding == "identity":
+        return Response(snapshot.body, media_type="application/json", headers=headers)
+    headers["content-encoding"] = coding
+    return Response(
+        snapshot.encoded[coding], media_type="application/json", headers=headers
+    )
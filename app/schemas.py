@@ -1,7 +1,9 @@
+import json
 from fastapi import File, Form, UploadFile
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from pydantic.alias_generators import to_camel
-from typing import Optional
+from datetime import datetime
+from typing import Literal, Optional
 
 class BaseSchema(BaseModel):
     model_config = ConfigDict(
@@ -22,6 +24,55 @@ class ServantResponse(BaseSchema):
     state: str
 
 
+class LocalizationRecord(BaseSchema):
+    id: int
+    servant_id: int
+    language: str
+    name: Optional[str] = None
+    description: Optional[str] = None
+    history: Optional[str] = None
+    prototype_person: Optional[str] = None
+    illustrator: Optional[str] = None
+    voice_actor: Optional[str] = None
+    temper: Optional[str] = None
+    intro: Optional[str] = None
+
+
+class ServantDetail(BaseSchema):
+    id: int
+    name: str
+    class_name: str
+    ascension_level: Optional[int]
+    level: Optional[int]
+    alignment: Optional[str]
+    gender: Optional[str]
+    state: Optional[str]
+    localizations: list[LocalizationRecord]
+
+
+class ServantPage(BaseSchema):
+    items: list[ServantResponse]
+    next_cursor: Optional[str] = None
+
+
+class ServantFilter(BaseModel):
+    class_name: Optional[str] = None
+    gender: Optional[str] = None
+    alignment: Optional[str] = None
+    state: Optional[str] = None
+    min_level: Optional[int] = None
+    max_level: Optional[int] = None
+
+
+class SearchResult(ServantResponse):
+    score: float
+
+
+class Suggestion(BaseSchema):
+    servant_id: int
+    name: str
+
+
 class ServantAndName(ServantResponse):
     true_name: Optional[str] = None
 
@@ -29,16 +80,169 @@ class ServantWithLocalization(ServantResponse):
     localizations : list["LocalizationResponse"]
 
 
-class LocalizationResponse(BaseSchema):
-    language: str
+class NoblePhantasmResponse(BaseSchema):
+    servant_id: int
+    rank: Optional[str]
+    activation_type: Optional[str]
     name: Optional[str]
     description: Optional[str]
-    history: Optional[str]
-    prototype_person: Optional[str]
-    illustrator: Optional[str]
-    voice_actor: Optional[str]
-    temper: Optional[str]
-    intro: Optional[str]
+
+
+class SkillResponse(BaseSchema):
+    id: int
+    skill_type: Optional[str]
+    rank: Optional[str]
+    name: Optional[str]
+    description: Optional[str]
+    icon: Optional[str]
+
+
+class AliasResponse(BaseSchema):
+    id: int
+    language_code: str
+    name: str
+
+
+class PictureResponse(BaseSchema):
+    servant_id: int
+    grade: int
+    picture: Optional[str]
+
+
+class PictureMetadata(BaseSchema):
+    servant_id: int
+    grade: int
+    url: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    sha256: Optional[str] = None
+    size: Optional[int] = None
+
+
+class PictureBatch(BaseSchema):
+    items: list[PictureMetadata]
+    next_cursor: Optional[str] = None
+
+
+class ServantExport(ServantWithLocalization):
+    noble_phantasm: Optional[NoblePhantasmResponse] = None
+    skills: list[SkillResponse]
+
+    @field_validator("skills", mode="before")
+    @classmethod
+    def unwrap_servant_skills(cls, skills):
+        # Servant.skills holds ServantSkill association rows
+        return [getattr(skill, "skill", skill) for skill in skills]
+
+
+class FullServantResponse(ServantExport):
+    aliases: list[AliasResponse]
+    pictures: list[PictureResponse]
+
+
+class LocalizationResponse(BaseSchema):
+    language: str
+    name: Optional[str] = None
+    description: Optional[str] = None
+    history: Optional[str] = None
+    prototype_person: Optional[str] = None
+    illustrator: Optional[str] = None
+    voice_actor: Optional[str] = None
+    temper: Optional[str] = None
+    intro: Optional[str] = None
+
+
+class MasterResponse(BaseSchema):
+    id: int
+    nickname: str
+    level: Optional[int]
+    date_registered: Optional[datetime]
+    display_name: Optional[str]
+
+
+class ContractResponse(BaseSchema):
+    master_id: int
+    servant_id: int
+    status: Optional[str]
+    start_date: Optional[datetime]
+    end_date: Optional[datetime]
+    command_spells: Optional[int]
+
+
+class MasterContract(ContractResponse):
+    servant: ServantResponse
+
+
+class MasterDetail(MasterResponse):
+    # only with embed=contracts
+    contracts: Optional[list[MasterContract]] = None
+
+
+class MasterPage(BaseSchema):
+    items: list[MasterDetail]
+    next_cursor: Optional[str] = None
+
+
+class MasterFilter(BaseModel):
+    min_level: Optional[int] = None
+    max_level: Optional[int] = None
+    registered_from: Optional[datetime] = None
+    registered_to: Optional[datetime] = None
+
+
+class ContractDetail(ContractResponse):
+    # only when named in embed
+    master: Optional[MasterResponse] = None
+    servant: Optional[ServantResponse] = None
+
+
+class ContractPage(BaseSchema):
+    items: list[ContractDetail]
+    next_cursor: Optional[str] = None
+
+
+class ContractFilter(BaseModel):
+    status: Optional[str] = None
+    master_id: Optional[int] = None
+    servant_id: Optional[int] = None
+    servant_class: Optional[str] = None
+    min_master_level: Optional[int] = None
+    max_master_level: Optional[int] = None
+    registered_from: Optional[datetime] = None
+    registered_to: Optional[datetime] = None
+
+
+class MessageResponse(BaseModel):
+    message: str
+
+
+class CreatedResponse(MessageResponse):
+    id: int
+
+
+class NameResponse(BaseModel):
+    name: str
+
+
+class CountResponse(BaseModel):
+    count: int
+
+
+class UploadResponse(MessageResponse):
+    filename: str
+    path: str
+    sha256: str
+    size: int
+
+
+class PictureUploadResponse(BaseModel):
+    id: int
+    grade: int
+    image: Optional[str]
+
+
+class ServantWithPictureResponse(CreatedResponse):
+    message2: PictureUploadResponse
 
 class ServantUpdate(BaseSchema):
     name: Optional[str] = None
@@ -78,6 +282,28 @@ class ContractUpdate(BaseModel):
     add_spells: int = 0
 
 
+class ContractOperation(BaseModel):
+    action: Literal["create", "end", "delete"]
+    master_id: int
+    servant_id: int
+
+
+class ContractBatch(BaseModel):
+    operations: list[ContractOperation]
+
+
+class ContractOperationResult(ContractOperation):
+    index: int
+    ok: bool
+    error: Optional[str] = None
+
+
+class ContractBatchResult(BaseModel):
+    results: list[ContractOperationResult]
+    succeeded: int
+    failed: int
+
+
 class CreatePicture(BaseModel):
     grade: int
     picture: UploadFile
@@ -135,3 +361,111 @@ class TopServantResponse(BaseModel):
     master_nickname: str
     servant_name: str
     servant_level: int
+
+
+class ServantImport(BaseModel):
+    id: int
+    name: str
+    class_name: str
+    gender: str
+    alignment: str
+    ascension_level: Optional[int] = None
+    level: Optional[int] = None
+    state: Optional[str] = None
+
+
+class SkillImport(BaseModel):
+    id: int
+    skill_type: str
+    rank: str
+    name: str
+    description: str
+    icon: Optional[str] = None
+
+
+class LocalizationImport(BaseModel):
+    servant_id: int
+    language: str
+    name: Optional[str] = None
+    description: Optional[str] = None
+    history: Optional[str] = None
+    prototype_person: Optional[str] = None
+    illustrator: Optional[str] = None
+    voice_actor: Optional[str] = None
+    temper: Optional[str] = None
+    intro: Optional[str] = None
+
+
+class CatalogImport(BaseModel):
+    servants: list[dict] = []
+    skills: list[dict] = []
+    noble_phantasms: list[dict] = []
+    localizations: list[dict] = []
+
+
+class ImportRowError(BaseModel):
+    entity: str
+    index: int
+    error: str
+
+
+class ImportResult(BaseModel):
+    written: dict[str, int]
+    errors: list[ImportRowError]
+
+
+class ProfilerSettings(BaseModel):
+    sample_rate: float = Field(0.01, ge=0, le=1)
+    route: Optional[str] = None
+    interval_ms: float = Field(10, ge=1, le=1000)
+    duration: int = Field(300, ge=1, le=3600)
+
+
+class ProfilerStatus(BaseModel):
+    enabled: bool
+    sample_rate: Optional[float] = None
+    route: Optional[str] = None
+    interval_ms: Optional[float] = None
+    started_at: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+
+class SyncServant(BaseSchema):
+    id: int
+    name: str
+    class_name: str
+    ascension_level: Optional[int]
+    level: Optional[int]
+    alignment: Optional[str]
+    gender: Optional[str]
+    state: Optional[str]
+    skill_ids: list[int] = Field(validation_alias="skills")
+
+    @field_validator("skill_ids", mode="before")
+    @classmethod
+    def servant_skill_ids(cls, skills):
+        return [getattr(skill, "skill_id", skill) for skill in skills]
+
+
+class SyncDeletion(BaseSchema):
+    entity: str
+    key: dict = Field(validation_alias="entity_key")
+
+    @field_validator("key", mode="before")
+    @classmethod
+    def parse_key(cls, key):
+        return json.loads(key) if isinstance(key, str) else key
+
+
+class SyncResponse(BaseSchema):
+    # pass token back as since; with hasMore, ask again right away.
+    # Apply deleted before the other lists: a row deleted and created again
+    # since the last sync is in both.
+    token: str
+    has_more: bool = False
+    servants: list[SyncServant] = []
+    localizations: list[LocalizationRecord] = []
+    skills: list[SkillResponse] = []
+    noble_phantasms: list[NoblePhantasmResponse] = []
+    pictures: list[PictureResponse] = []
+    deleted: list[SyncDeletion] = []
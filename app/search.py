@@ -0,0 +1,72 @@
+import asyncio
+from bisect import bisect_left
+
+from .cache import catalog_cache
+
+# writes to these bump the cache generation and make the index stale
+INDEX_SOURCES = ("servant_list", "localization", "alias")
+
+
+def normalize(value: str) -> str:
+    return " ".join(value.casefold().split())
+
+
+class PrefixIndex:
+    # Sorted keys for every word start of every name, so "pend" finds
+    # "Artoria Pendragon". Entries are (servant_id, language, name), with
+    # language None for names that are not tied to one.
+    def __init__(self):
+        self._keys: list[str] = []
+        self._entries: list[tuple[int, str | None, str]] = []
+        self._generations = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def stale(self) -> bool:
+        return self._generations != self._current_generations()
+
+    @staticmethod
+    def _current_generations():
+        return tuple(catalog_cache.generation(source) for source in INDEX_SOURCES)
+
+    def build(self, names):
+        items = []
+        for servant_id, language, name in names:
+            if not name:
+                continue
+            normalized = normalize(name)
+            starts = [0] + [i + 1 for i, c in enumerate(normalized) if c == " "]
+            for start in starts:
+                items.append((normalized[start:], (servant_id, language, name)))
+        items.sort(key=lambda item: item[0])
+        self._keys = [key for key, _ in items]
+        self._entries = [entry for _, entry in items]
+
+    async def refresh(self, loader):
+        async with self._lock:
+            if not self.stale:
+                return
+            generations = self._current_generations()
+            self.build(await loader())
+            self._generations = generations
+
+    def lookup(self, prefix: str, language: str | None = None, limit: int = 10):
+        prefix = normalize(prefix)
+        results = {}
+        if not prefix:
+            return []
+        i = bisect_left(self._keys, prefix)
+        while i < len(self._keys) and self._keys[i].startswith(prefix):
+            servant_id, entry_language, name = self._entries[i]
+            if language is None or entry_language in (None, language):
+                results.setdefault(servant_id, name)
+                if len(results) >= limit:
+                    break
+            i += 1
+        return [
+            {"servant_id": servant_id, "name": name}
+            for servant_id, name in results.items()
+        ]
+
+
+prefix_index = PrefixIndex()
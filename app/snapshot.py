@@ -0,0 +1,176 @@
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+import time
+from typing import NamedTuple
+
+import orjson
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from starlette.concurrency import run_in_threadpool
+
+from .cache import catalog_cache
+from .database import SessionLocal
+from .models import Servant, ServantSkill
+from .schemas import FullServantResponse
+from .utils import DEFAULT_LANGUAGE
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_POLL_INTERVAL = float(os.getenv("SNAPSHOT_POLL_INTERVAL", 1))
+# the cache entities ServantService invalidates on catalog writes; a new
+# generation of any of them means the snapshot is out of date
+SOURCES = ("servant_list", "localization", "np", "skills", "image_path")
+
+
+class Snapshot(NamedTuple):
+    language: str
+    # hash of the uncompressed body, so every worker that builds from the
+    # same data serves the same ETag
+    version: str
+    built_at: float
+    body: bytes
+    # content-coding -> compressed body
+    encoded: dict[str, bytes]
+
+    def etag(self, coding: str = "identity") -> str:
+        # each coding is a different representation, so it needs its own
+        # strong validator
+        if coding == "identity":
+            return f'"{self.version}"'
+        return f'"{self.version}-{coding}"'
+
+
+async def load_catalog(db) -> list[Servant]:
+    # only the query runs on the event loop; every relationship the
+    # snapshot reads is loaded here, so render_all can validate the
+    # detached objects in a worker thread without lazy loads
+    query = (
+        select(Servant)
+        .options(
+            selectinload(Servant.localizations),
+            selectinload(Servant.noble_phantasm),
+            selectinload(Servant.skills).joinedload(ServantSkill.skill),
+            selectinload(Servant.aliases),
+            selectinload(Servant.pictures),
+        )
+        .order_by(Servant.id)
+    )
+    return list((await db.execute(query)).scalars().all())
+
+
+def render(servants: list[dict], language: str, built_at: float) -> Snapshot:
+    # each servant keeps one localization: the language's own, else the
+    # default language's
+    ranked = (language, DEFAULT_LANGUAGE)
+    localized = []
+    for servant in servants:
+        localizations = sorted(
+            (l for l in servant["localizations"] if l["language"] in ranked),
+            key=lambda l: ranked.index(l["language"]),
+        )
+        localized.append({**servant, "localizations": localizations[:1]})
+    body = orjson.dumps({"language": language, "servants": localized})
+    encoded = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body)
+    version = hashlib.sha256(body).hexdigest()[:20]
+    return Snapshot(language, version, built_at, body, encoded)
+
+
+def render_all(catalog: list[Servant], built_at: float) -> dict[str, Snapshot]:
+    servants = [
+        FullServantResponse.model_validate(servant).model_dump(
+            mode="json", by_alias=True
+        )
+        for servant in catalog
+    ]
+    languages = {
+        localization["language"]
+        for servant in servants
+        for localization in servant["localizations"]
+    }
+    languages.add(DEFAULT_LANGUAGE)
+    return {
+        language: render(servants, language, built_at) for language in sorted(languages)
+    }
+
+
+class SnapshotStore:
+    # One per worker. A background task watches the generations of SOURCES
+    # and rebuilds every language's snapshot when one moves; requests only
+    # ever read self.snapshots, which is swapped in whole.
+    def __init__(self):
+        self.snapshots: dict[str, Snapshot] = {}
+        self.generation = None
+        self.builds = 0
+        self.failures = 0
+        self._task = None
+
+    def source_generation(self) -> tuple[int, ...]:
+        return tuple(catalog_cache.generation(entity) for entity in SOURCES)
+
+    def get(self, languages: list[str]) -> Snapshot | None:
+        snapshots = self.snapshots
+        for language in languages:
+            if language in snapshots:
+                return snapshots[language]
+        return snapshots.get(DEFAULT_LANGUAGE)
+
+    async def rebuild(self):
+        # read before loading: a write that lands during the build moves the
+        # generation again and gets its own rebuild
+        generation = self.source_generation()
+        async with SessionLocal() as db:
+            catalog = await load_catalog(db)
+        self.snapshots = await run_in_threadpool(render_all, catalog, time.time())
+        self.generation = generation
+        self.builds += 1
+
+    async def _run(self):
+        while True:
+            if self.source_generation() != self.generation:
+                try:
+                    await self.rebuild()
+                except Exception:
+                    self.failures += 1
+                    logger.exception("catalog snapshot build failed")
+            await asyncio.sleep(SNAPSHOT_POLL_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "builds": self.builds,
+            "failures": self.failures,
+            "encodings": ["identity", "gzip"] + (["br"] if brotli else []),
+            "languages": {
+                language: {
+                    "version": snapshot.version,
+                    "built_at": snapshot.built_at,
+                    "size": len(snapshot.body),
+                    **{
+                        f"{coding}_size": len(blob)
+                        for coding, blob in snapshot.encoded.items()
+                    },
+                }
+                for language, snapshot in self.snapshots.items()
+            },
+        }
+
+
+catalog_snapshots = SnapshotStore()
@@ -1,16 +1,193 @@
+import base64
+import hashlib
+import json
 import os
-import shutil
+import tempfile
 from pathlib import Path
+from typing import NamedTuple
 
-MEDIA_DIR = Path("media") / "servants"
-SKILL_DIR = Path("media") / "skills"
-os.makedirs(MEDIA_DIR, exist_ok=True)
-os.makedirs(SKILL_DIR, exist_ok=True)
+from starlette.concurrency import run_in_threadpool
 
-def save_file_to_disk(upload_file, path: Path):
+OBJECT_DIR = Path("media") / "objects"
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_SIZE = 500
+SYNC_PAGE_SIZE = 500
+MAX_SYNC_PAGE_SIZE = 5000
+
+DEFAULT_LANGUAGE = os.getenv("DEFAULT_LANGUAGE", "en")
+# the languages the catalog is localized into; any other requested tag is
+# dropped before it reaches a query or a cache key
+SUPPORTED_LANGUAGES = frozenset(
+    tag.strip().lower()
+    for tag in os.getenv("SUPPORTED_LANGUAGES", "en,ru,ja,de,fr").split(",")
+    if tag.strip()
+) | {DEFAULT_LANGUAGE}
+MAX_LANGUAGES = 8
+# the text columns of ServantLocalization a field mask can select
+LOCALIZATION_FIELDS = (
+    "name",
+    "description",
+    "history",
+    "prototype_person",
+    "illustrator",
+    "voice_actor",
+    "temper",
+    "intro",
+)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 10 * 1024 * 1024))
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class StoredFile(NamedTuple):
+    path: str
+    digest: str
+    size: int
+
+
+class LocalizationProjection(NamedTuple):
+    # languages in preference order, empty for all; fields always in
+    # LOCALIZATION_FIELDS order so equal masks share a cache entry
+    languages: tuple[str, ...]
+    fields: tuple[str, ...]
+
+
+def object_path(digest: str, suffix: str) -> Path:
+    return OBJECT_DIR / digest[:2] / f"{digest}{suffix.lower()}"
+
+
+def _write_chunk(buffer, digest, chunk: bytes):
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+def _open_part() -> tuple[int, str]:
+    # the object store is created on first upload, not at import
+    os.makedirs(OBJECT_DIR, exist_ok=True)
+    return tempfile.mkstemp(dir=OBJECT_DIR, suffix=".part")
+
+
+def _store(tmp_path: str, path: Path):
     os.makedirs(path.parent, exist_ok=True)
-    
-    with open(path, "wb") as buffer:
-        shutil.copyfileobj(upload_file.file, buffer)
-    
-    return str(path)
\ No newline at end of file
+    if path.exists():
+        # same content is already stored under this name
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+
+
+async def save_file_to_disk(
+    upload_file, suffix: str, max_size: int = MAX_UPLOAD_SIZE
+) -> StoredFile:
+    # Streams the upload in chunks to a temp file next to the object store,
+    # hashing on the way, then renames it to its content address. Disk work
+    # runs in the thread pool so a large upload doesn't block the loop.
+    fd, tmp_path = await run_in_threadpool(_open_part)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while chunk := await upload_file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(f"File is larger than {max_size} bytes")
+                await run_in_threadpool(_write_chunk, buffer, digest, chunk)
+        path = object_path(digest.hexdigest(), suffix)
+        await run_in_threadpool(_store, tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return StoredFile(str(path), digest.hexdigest(), size)
+
+
+def encode_cursor(position: dict) -> str:
+    raw = json.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor")
+    return position
+
+
+def cursor_values(cursor: str, *keys: str) -> tuple[int, ...]:
+    # the integer keys of a keyset cursor, in order; bools are ints to
+    # isinstance and would reach SQL as a comparison with True
+    position = decode_cursor(cursor)
+    values = tuple(position.get(key) for key in keys)
+    if not all(type(value) is int for value in values):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def parse_languages(value: str) -> list[str]:
+    # "ru,en" from ?lang=, most preferred first
+    return [tag.strip().lower() for tag in value.split(",") if tag.strip()]
+
+
+def parse_accept_language(header: str | None) -> list[str]:
+    # "ru-RU,ru;q=0.9,en;q=0.5" -> ["ru-ru", "ru", "en"]; a regional tag is
+    # followed by its primary language, which is how localizations are stored
+    ranked = []
+    for position, part in enumerate((header or "").split(",")):
+        tag, _, params = part.strip().partition(";")
+        tag = tag.strip().lower()
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        if tag and tag != "*" and quality > 0:
+            ranked.append((-quality, position, tag))
+    languages = []
+    for _, _, tag in sorted(ranked):
+        for language in (tag, tag.split("-")[0]):
+            if language not in languages:
+                languages.append(language)
+    return languages[:MAX_LANGUAGES]
+
+
+def localization_projection(
+    lang: str | None, accept_language: str | None, fields: str | None
+) -> LocalizationProjection | None:
+    # None keeps the full payload: every language, every field. lang=*
+    # asks for every language whatever Accept-Language says. Unsupported
+    # tags are dropped, so a list of only those falls back to the default
+    # language and shares its cache entry.
+    if lang == "*":
+        languages = []
+    elif lang:
+        languages = parse_languages(lang)[:MAX_LANGUAGES]
+    else:
+        languages = parse_accept_language(accept_language)
+    if languages:
+        languages = [
+            language for language in languages if language in SUPPORTED_LANGUAGES
+        ]
+        if DEFAULT_LANGUAGE not in languages:
+            languages.append(DEFAULT_LANGUAGE)
+    if fields is None:
+        mask = LOCALIZATION_FIELDS
+    else:
+        requested = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = requested - set(LOCALIZATION_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        mask = tuple(field for field in LOCALIZATION_FIELDS if field in requested)
+    if not languages and mask == LOCALIZATION_FIELDS:
+        return None
+    return LocalizationProjection(tuple(languages), mask)
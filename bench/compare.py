@@ -0,0 +1,47 @@
+import argparse
+import json
+from pathlib import Path
+
+
+def change(before: float | None, after: float | None) -> str:
+    if not before or after is None:
+        return "     -"
+    return f"{(after - before) / before * 100:+6.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two bench result files")
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    args = parser.parse_args()
+
+    before = json.loads(args.before.read_text())
+    after = json.loads(args.after.read_text())
+    for label, result in (("before", before), ("after", after)):
+        meta = result["meta"]
+        print(
+            f"{label:6} {meta['revision']} {meta['label']} {meta['dialect']} "
+            f"scale={meta['scale']} concurrency={meta['concurrency']}"
+        )
+    print(
+        f"{'scenario':32} {'rps':>10} {'':>7} {'p50 ms':>9} {'':>7} "
+        f"{'p99 ms':>9} {'':>7} {'q/req':>6}"
+    )
+    for name, new in after["scenarios"].items():
+        old = before["scenarios"].get(name)
+        if old is None:
+            print(f"{name:32} (new)")
+            continue
+        queries = (new["queries_per_request"] or {}).get("mean", "-")
+        print(
+            f"{name:32} {new['rps']:>10.1f} {change(old['rps'], new['rps'])}"
+            f" {new['latency_ms']['p50']:>9.2f}"
+            f" {change(old['latency_ms']['p50'], new['latency_ms']['p50'])}"
+            f" {new['latency_ms']['p99']:>9.2f}"
+            f" {change(old['latency_ms']['p99'], new['latency_ms']['p99'])}"
+            f" {queries:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
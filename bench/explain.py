@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+
+import httpx
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from .scenarios import select
+from .seed import volumes
+
+# (scenario, table) pairs that are read in full on purpose: these routes
+# return or aggregate the whole table, so no index can help
+ALLOWED_SCANS = {
+    ("servants_list", "servant"),
+    ("servants_list", "servant_localization"),
+    ("servants_list_names", "servant"),
+    ("servants_list_names", "servant_localization"),
+    ("export_ndjson", "servant"),
+    ("export_ndjson", "servant_localization"),
+    ("summoned_servants", "contract"),
+    ("summoned_servants", "servant"),
+    ("summoned_servants", "servant_localization"),
+    ("summoned_servants", "master"),
+    ("female_servants_descriptions", "servant"),
+    ("female_servants_descriptions", "servant_localization"),
+    ("top_servants", "master_top_servant"),
+    ("top_servants", "master"),
+    ("level_analys", "class_level_summary"),
+    ("skills", "skill"),
+    ("np_all", "noble_phantasm"),
+    ("all_localization", "servant"),
+    ("all_localization", "servant_localization"),
+    # loads every name once to build the in-memory prefix index
+    ("search_suggest", "servant"),
+    ("search_suggest", "alias"),
+    ("search_suggest", "servant_localization"),
+}
+
+_captured: list[tuple[str, object]] | None = None
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _capture(conn, cursor, statement, parameters, context, executemany):
+    if _captured is not None and statement.split(None, 1)[0].upper() in ("SELECT", "WITH"):
+        _captured.append((statement, parameters))
+
+
+async def capture(app, scenarios, sizes, rng) -> dict[str, list]:
+    # one request per scenario with an empty cache, so every loader runs
+    global _captured
+    from app.cache import catalog_cache
+
+    statements = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://explain") as client:
+        for scenario in scenarios:
+            request = scenario.build(rng, sizes)
+            catalog_cache.clear()
+            _captured = []
+            try:
+                response = await client.request(
+                    request.method,
+                    request.url,
+                    params=request.params,
+                    json=request.json,
+                    data=request.data,
+                    headers=request.headers,
+                )
+                await response.aread()
+                status = response.status_code
+            except Exception as e:
+                status = repr(e)
+            finally:
+                captured, _captured = _captured, None
+            if not isinstance(status, int) or status >= 500:
+                # statements run before the failure are still checked
+                print(f"{scenario.name}: {status}", file=sys.stderr)
+            unique = {}
+            for statement, parameters in captured:
+                unique.setdefault(statement, parameters)
+            statements[scenario.name] = list(unique.items())
+    return statements
+
+
+def postgres_scans(plan: dict):
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from postgres_scans(child)
+
+
+async def full_scans(conn, statement: str, parameters) -> set[str]:
+    if conn.dialect.name == "postgresql":
+        result = await conn.exec_driver_sql(
+            "EXPLAIN (FORMAT JSON) " + statement, parameters
+        )
+        plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return set(postgres_scans(plan[0]["Plan"]))
+    rows = await conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+    # "SCAN servant" reads the table; "SCAN servant USING INDEX ..." and
+    # "SEARCH ..." go through an index
+    scans = set()
+    for row in rows:
+        words = row[-1].split()
+        if len(words) in (2, 4) and words[0] == "SCAN" and "USING" not in words:
+            scans.add(words[1])
+    return scans
+
+
+async def table_sizes(conn) -> dict[str, float]:
+    if conn.dialect.name == "postgresql":
+        rows = await conn.execute(
+            text(
+                "SELECT relname, reltuples FROM pg_class "
+                "WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace"
+            )
+        )
+        return {name: tuples for name, tuples in rows}
+    names = await conn.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'table'")
+    )
+    sizes = {}
+    for (name,) in names.all():
+        sizes[name] = (await conn.execute(text(f'SELECT count(*) FROM "{name}"'))).scalar()
+    return sizes
+
+
+async def check(args) -> list[str]:
+    from app.database import engine
+    from app.main import app
+
+    scenarios = select(args.scenarios, False, engine.dialect.name)
+    statements = await capture(
+        app, scenarios, volumes(args.scale), random.Random(args.random_seed)
+    )
+    failures = []
+    async with engine.connect() as conn:
+        sizes = await table_sizes(conn)
+        for name, captured in statements.items():
+            for statement, parameters in captured:
+                scans = await full_scans(conn, statement, parameters)
+                large = sorted(
+                    table
+                    for table in scans
+                    if sizes.get(table, 0) >= args.min_rows
+                    and (name, table) not in ALLOWED_SCANS
+                )
+                verdict = "FAIL" if large else "ok"
+                print(
+                    f"{verdict:4} {name:32} scans {','.join(sorted(scans)) or '-':40}"
+                    f" {' '.join(statement.split())[:100]}"
+                )
+                if large:
+                    failures.append(f"{name}: sequential scan of {', '.join(large)}")
+    return failures
+
+
+async def check_and_dispose(args) -> list[str]:
+    from app.database import engine
+
+    try:
+        return await check(args)
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="EXPLAIN every read statement the routes issue and fail on "
+        "sequential scans of large tables"
+    )
+    parser.add_argument("--scale", type=float, default=1.0, help="as passed to seed")
+    parser.add_argument("--scenarios", nargs="*", help="names, default all reads")
+    parser.add_argument(
+        "--min-rows", type=int, default=5000, help="smaller tables may be scanned"
+    )
+    parser.add_argument("--random-seed", type=int, default=1)
+    args = parser.parse_args()
+
+    failures = asyncio.run(check_and_dispose(args))
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from .scenarios import Scenario, select
+from .seed import volumes
+
+RESULTS_DIR = Path(__file__).parent / "results"
+BENCH_ID = "x-bench-id"
+
+
+class QueryCounter:
+    # Wraps the ASGI app so every statement executed while serving a request,
+    # streamed bodies included, is counted against that request even with many
+    # requests in flight.
+    def __init__(self, app):
+        self.app = app
+        self.counts: dict[str, int] = {}
+
+    async def __call__(self, scope, receive, send):
+        from app.instrumentation import QueryStats, collect
+
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        with collect(QueryStats()) as stats:
+            await self.app(scope, receive, send)
+        for name, value in scope["headers"]:
+            if name == BENCH_ID.encode():
+                self.counts[value.decode()] = stats.queries
+
+    def pop(self, request_id: str) -> int | None:
+        return self.counts.pop(request_id, None)
+
+
+def percentile(values: list[float], q: float) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def summarize(samples: list[tuple], elapsed: float) -> dict:
+    latencies = [latency * 1000 for latency, _, _ in samples]
+    statuses: dict[str, int] = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    queries = [count for _, _, count in samples if count is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(
+            1
+            for _, status, _ in samples
+            if not isinstance(status, int) or status >= 400
+        ),
+        "statuses": statuses,
+        "rps": round(len(samples) / elapsed, 2),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "mean": round(statistics.fmean(latencies), 3),
+            "max": round(max(latencies), 3),
+        },
+        "queries_per_request": (
+            {"mean": round(statistics.fmean(queries), 2), "max": max(queries)}
+            if queries
+            else None
+        ),
+    }
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    sizes: dict,
+    requests: int,
+    concurrency: int,
+    rng: random.Random,
+    counter: QueryCounter | None,
+) -> tuple[list[tuple], float]:
+    ids = itertools.count()
+    samples = []
+
+    async def worker():
+        while (index := next(ids)) < requests:
+            request = scenario.build(rng, sizes)
+            request_id = f"{scenario.name}-{index}"
+            headers = {**(request.headers or {}), BENCH_ID: request_id}
+            started = time.perf_counter()
+            try:
+                response = await client.request(
+                    request.method,
+                    request.url,
+                    params=request.params,
+                    json=request.json,
+                    data=request.data,
+                    headers=headers,
+                )
+                await response.aread()
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            latency = time.perf_counter() - started
+            samples.append(
+                (latency, status, counter.pop(request_id) if counter else None)
+            )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    return samples, time.perf_counter() - started
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    counter = None
+    if args.base_url:
+        transport = None
+        dialect = args.dialect
+    else:
+        from app.database import engine
+        from app.main import app
+
+        if args.seed:
+            from .seed import seed
+
+            print("seeding", await seed(args.scale, create_schema=args.create_schema))
+        counter = QueryCounter(app)
+        transport = httpx.ASGITransport(app=counter)
+        dialect = engine.dialect.name
+
+    scenarios = select(args.scenarios, args.writes, dialect)
+    sizes = volumes(args.scale)
+    rng = random.Random(args.random_seed)
+    results = {}
+    async with httpx.AsyncClient(
+        transport=transport,
+        base_url=args.base_url or "http://bench",
+        timeout=args.timeout,
+    ) as client:
+        for scenario in scenarios:
+            requests = args.requests // 10 if scenario.heavy else args.requests
+            requests = max(requests, 1)
+            warmup = min(args.warmup, requests)
+            await drive(client, scenario, sizes, warmup, args.concurrency, rng, counter)
+            samples, elapsed = await drive(
+                client, scenario, sizes, requests, args.concurrency, rng, counter
+            )
+            results[scenario.name] = summarize(samples, elapsed)
+            line = results[scenario.name]
+            print(
+                f"{scenario.name:32} {line['rps']:>9.1f} rps"
+                f"  p50 {line['latency_ms']['p50']:>8.2f}"
+                f"  p95 {line['latency_ms']['p95']:>8.2f}"
+                f"  p99 {line['latency_ms']['p99']:>8.2f} ms"
+                f"  q/req {(line['queries_per_request'] or {}).get('mean', '-')}"
+                f"  errors {line['errors']}",
+                file=sys.stderr,
+            )
+    return {
+        "meta": {
+            "label": args.label,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dialect": dialect,
+            "target": args.base_url or "in-process",
+            "cache_backend": os.getenv("CACHE_BACKEND", "memory"),
+            "scale": args.scale,
+            "sizes": sizes,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+        },
+        "scenarios": results,
+    }
+
+
+async def run_and_dispose(args) -> dict:
+    try:
+        return await run(args)
+    finally:
+        if not args.base_url:
+            from app.database import engine
+
+            await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test every API route")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="per scenario")
+    parser.add_argument("--scale", type=float, default=1.0, help="as passed to seed")
+    parser.add_argument("--scenarios", nargs="*", help="names, default all reads")
+    parser.add_argument("--writes", action="store_true", help="include write routes")
+    parser.add_argument("--seed", action="store_true", help="seed before running")
+    parser.add_argument("--create-schema", action="store_true")
+    parser.add_argument("--base-url", help="benchmark a running server instead")
+    parser.add_argument("--dialect", default="postgresql", help="with --base-url")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--random-seed", type=int, default=1)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    result = asyncio.run(run_and_dispose(args))
+    output = args.output
+    if output is None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = RESULTS_DIR / f"{stamp}-{result['meta']['revision'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
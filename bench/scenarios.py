@@ -0,0 +1,303 @@
+import random
+from typing import Callable, NamedTuple
+
+from app.utils import encode_cursor
+
+from .seed import CLASSES, LANGUAGES, SYLLABLES
+
+
+class Request(NamedTuple):
+    method: str
+    url: str
+    params: dict | None = None
+    json: dict | list | None = None
+    data: dict | None = None
+    headers: dict | None = None
+
+
+class Scenario(NamedTuple):
+    name: str
+    build: Callable[[random.Random, dict], Request]
+    # heavy scenarios return the whole catalog and get a tenth of the requests
+    heavy: bool = False
+    write: bool = False
+    postgres_only: bool = False
+
+
+def servant_id(rng: random.Random, sizes: dict) -> int:
+    return rng.randint(1, sizes["servants"])
+
+
+def master_id(rng: random.Random, sizes: dict) -> int:
+    return rng.randint(1, sizes["masters"])
+
+
+def picture_servant_id(rng: random.Random, sizes: dict) -> int:
+    return rng.randint(1, min(sizes["pictures"], sizes["servants"]))
+
+
+def get(url: str, **kwargs) -> Callable[[random.Random, dict], Request]:
+    return lambda rng, sizes: Request("GET", url, **kwargs)
+
+
+SCENARIOS = [
+    Scenario("root", get("/")),
+    Scenario("summoned_servants", get("/summoned_servants"), heavy=True),
+    Scenario("top_servants", get("/top_servants"), heavy=True),
+    Scenario(
+        "female_servants_descriptions",
+        get("/female_servants_descriptions"),
+        heavy=True,
+    ),
+    Scenario("level_analys", get("/level_analys")),
+    Scenario("cache_stats", get("/cache/stats")),
+    Scenario("db_pool", get("/db/pool")),
+    Scenario(
+        "servants_page",
+        lambda rng, sizes: Request(
+            "GET", "/servants", params={"limit": 50, "class_name": rng.choice(CLASSES)}
+        ),
+    ),
+    Scenario("servants_list", get("/servants_list"), heavy=True),
+    Scenario(
+        "servants_list_names",
+        lambda rng, sizes: Request(
+            "GET",
+            "/servants_list",
+            params={"fields": "name"},
+            headers={"Accept-Language": f"{rng.choice(LANGUAGES)},en;q=0.5"},
+        ),
+        heavy=True,
+    ),
+    Scenario("export_ndjson", get("/export/servants"), heavy=True),
+    # a client that has everything: the one max(row_version) query
+    Scenario(
+        "sync_up_to_date",
+        get("/sync", params={"since": encode_cursor({"version": 2**62})}),
+    ),
+    Scenario(
+        "servant",
+        lambda rng, sizes: Request("GET", f"/servants/{servant_id(rng, sizes)}"),
+    ),
+    Scenario(
+        "servant_full",
+        lambda rng, sizes: Request("GET", f"/servants/{servant_id(rng, sizes)}/full"),
+    ),
+    Scenario(
+        "servant_localized",
+        lambda rng, sizes: Request(
+            "GET",
+            f"/servants/{servant_id(rng, sizes)}",
+            params={"lang": rng.choice(LANGUAGES), "fields": "name,description"},
+        ),
+    ),
+    Scenario(
+        "servant_aliases",
+        lambda rng, sizes: Request(
+            "GET", f"/servants/{servant_id(rng, sizes)}/aliases"
+        ),
+    ),
+    Scenario(
+        "search",
+        lambda rng, sizes: Request(
+            "GET", "/search", params={"q": "".join(rng.sample(SYLLABLES, 2))}
+        ),
+        postgres_only=True,
+    ),
+    Scenario(
+        "search_suggest",
+        lambda rng, sizes: Request(
+            "GET", "/search/suggest", params={"prefix": rng.choice(SYLLABLES)}
+        ),
+    ),
+    Scenario(
+        "servant_name",
+        lambda rng, sizes: Request(
+            "GET", f"/name/{servant_id(rng, sizes)}/{rng.choice(LANGUAGES)}"
+        ),
+    ),
+    Scenario(
+        "masters",
+        lambda rng, sizes: Request(
+            "GET",
+            "/masters",
+            params={
+                "limit": 50,
+                "cursor": encode_cursor({"id": master_id(rng, sizes)}),
+            },
+        ),
+    ),
+    Scenario(
+        "master_dashboard",
+        lambda rng, sizes: Request(
+            "GET",
+            "/masters",
+            params={
+                "limit": 20,
+                "embed": "contracts",
+                "min_level": rng.randint(1, 50),
+                "cursor": encode_cursor({"id": master_id(rng, sizes)}),
+            },
+        ),
+    ),
+    Scenario(
+        "master",
+        lambda rng, sizes: Request("GET", f"/masters/{master_id(rng, sizes)}"),
+    ),
+    Scenario(
+        "master_active_count",
+        lambda rng, sizes: Request(
+            "GET", f"/masters/{master_id(rng, sizes)}/active_count"
+        ),
+    ),
+    Scenario(
+        "contracts_all",
+        get("/contracts/all", params={"limit": 50, "status": "active"}),
+    ),
+    Scenario(
+        "contracts_embedded",
+        lambda rng, sizes: Request(
+            "GET",
+            "/contracts/all",
+            params={
+                "limit": 50,
+                "servant_class": rng.choice(CLASSES),
+                "embed": ["master", "servant"],
+                "cursor": encode_cursor(
+                    {"master_id": master_id(rng, sizes), "servant_id": 0}
+                ),
+            },
+        ),
+    ),
+    Scenario(
+        "contract",
+        lambda rng, sizes: Request(
+            "GET",
+            "/contracts",
+            params={
+                "servant_id": servant_id(rng, sizes),
+                "master_id": master_id(rng, sizes),
+            },
+        ),
+    ),
+    Scenario("all_localization", get("/all_localization"), heavy=True),
+    Scenario("np_all", get("/np/all"), heavy=True),
+    Scenario(
+        "localization",
+        lambda rng, sizes: Request(
+            "GET",
+            f"/localization/{servant_id(rng, sizes)}",
+            params={"language": rng.choice(LANGUAGES)},
+        ),
+    ),
+    Scenario(
+        "servant_skills",
+        lambda rng, sizes: Request("GET", f"/skill/{servant_id(rng, sizes)}"),
+    ),
+    Scenario("skills", get("/skills"), heavy=True),
+    Scenario(
+        "get_image",
+        lambda rng, sizes: Request(
+            "GET",
+            "/get_image",
+            params={"servant_id": picture_servant_id(rng, sizes), "grade": 1},
+        ),
+    ),
+    Scenario(
+        "get_image_webp_256",
+        lambda rng, sizes: Request(
+            "GET",
+            "/get_image",
+            params={
+                "servant_id": picture_servant_id(rng, sizes),
+                "grade": 1,
+                "width": 256,
+            },
+            headers={"accept": "image/webp"},
+        ),
+    ),
+    Scenario(
+        "pictures_batch",
+        lambda rng, sizes: Request("GET", "/pictures", params={"limit": 100}),
+        postgres_only=True,
+    ),
+    Scenario(
+        "create_master",
+        lambda rng, sizes: Request(
+            "POST",
+            "/masters",
+            data={
+                "nickname": f"bench{rng.getrandbits(48)}",
+                "display_name": "bench",
+            },
+        ),
+        write=True,
+    ),
+    Scenario(
+        "update_servant",
+        lambda rng, sizes: Request(
+            "PUT",
+            f"/servants/{servant_id(rng, sizes)}",
+            json={"level": rng.randint(1, 120)},
+        ),
+        write=True,
+    ),
+    Scenario(
+        "import_servants",
+        lambda rng, sizes: Request(
+            "POST",
+            "/import",
+            json={
+                "servants": [
+                    {
+                        "id": servant_id(rng, sizes),
+                        "name": f"Imported {index}",
+                        "class_name": rng.choice(CLASSES),
+                        "gender": "unknown",
+                        "alignment": "neutral",
+                    }
+                    for index in range(50)
+                ]
+            },
+        ),
+        heavy=True,
+        write=True,
+        postgres_only=True,
+    ),
+    Scenario(
+        "contracts_batch",
+        lambda rng, sizes: Request(
+            "POST",
+            "/contracts/batch",
+            json={
+                "operations": [
+                    {
+                        "action": rng.choice(("create", "end", "delete")),
+                        "master_id": master_id(rng, sizes),
+                        "servant_id": servant_id(rng, sizes),
+                    }
+                    for _ in range(20)
+                ]
+            },
+        ),
+        write=True,
+        postgres_only=True,
+    ),
+]
+
+
+def select(names: list[str] | None, writes: bool, dialect: str) -> list[Scenario]:
+    scenarios = []
+    for scenario in SCENARIOS:
+        if names:
+            if scenario.name not in names:
+                continue
+        elif (scenario.write and not writes) or (
+            scenario.postgres_only and dialect != "postgresql"
+        ):
+            continue
+        scenarios.append(scenario)
+    unknown = set(names or []) - {scenario.name for scenario in SCENARIOS}
+    if unknown:
+        raise SystemExit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return scenarios
@@ -0,0 +1,319 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select, text
+
+CLASSES = ["saber", "archer", "lancer", "rider", "caster", "assassin", "berserker"]
+ALIGNMENTS = [
+    "lawful good",
+    "neutral good",
+    "chaotic good",
+    "lawful evil",
+    "chaotic evil",
+]
+GENDERS = ["male", "female", "unknown"]
+LANGUAGES = ["en", "ru", "ja", "de", "fr"]
+SYLLABLES = [
+    "ar",
+    "tor",
+    "ia",
+    "gil",
+    "ga",
+    "mesh",
+    "me",
+    "du",
+    "sa",
+    "kar",
+    "na",
+    "lo",
+]
+
+# 10k servants, 50k localizations, 100k contracts at scale 1
+VOLUMES = {
+    "servants": 10_000,
+    "masters": 20_000,
+    "contracts_per_master": 5,
+    "skills": 2_000,
+    "skills_per_servant": 3,
+    "pictures": 200,
+}
+CHUNK_SIZE = 2_000
+
+
+def volumes(scale: float) -> dict:
+    sizes = {key: max(1, int(value * scale)) for key, value in VOLUMES.items()}
+    sizes["contracts_per_master"] = VOLUMES["contracts_per_master"]
+    sizes["skills_per_servant"] = VOLUMES["skills_per_servant"]
+    return sizes
+
+
+def fake_name(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+
+
+def servant_rows(rng: random.Random, count: int):
+    for id in range(1, count + 1):
+        yield {
+            "id": id,
+            "name": f"{fake_name(rng)} {id}",
+            "class_name": rng.choice(CLASSES),
+            "ascension_level": rng.randint(0, 4),
+            "level": rng.randint(1, 120),
+            "state": "available",
+            "alignment": rng.choice(ALIGNMENTS),
+            "gender": rng.choice(GENDERS),
+        }
+
+
+def localization_rows(rng: random.Random, servants: int):
+    id = 0
+    for servant_id in range(1, servants + 1):
+        for language in LANGUAGES:
+            id += 1
+            yield {
+                "id": id,
+                "servant_id": servant_id,
+                "language": language,
+                "name": f"{fake_name(rng)} ({language})",
+                "description": " ".join(fake_name(rng) for _ in range(40)),
+                "history": " ".join(fake_name(rng) for _ in range(80)),
+                "prototype_person": fake_name(rng),
+                "illustrator": fake_name(rng),
+                "voice_actor": fake_name(rng),
+                "temper": " ".join(fake_name(rng) for _ in range(20)),
+                "intro": " ".join(fake_name(rng) for _ in range(10)),
+            }
+
+
+def master_rows(rng: random.Random, count: int):
+    registered = datetime(2020, 1, 1)
+    for id in range(1, count + 1):
+        yield {
+            "id": id,
+            "nickname": f"master{id}",
+            "display_name": fake_name(rng),
+            "level": rng.randint(1, 160),
+            "date_registered": registered + timedelta(minutes=id),
+        }
+
+
+def contract_rows(rng: random.Random, masters: int, servants: int, per_master: int):
+    from app.models import CONTRACT_ACTIVE, CONTRACT_TERMINATED
+
+    # the database allows one active contract per servant
+    active = set()
+    start = datetime(2021, 1, 1)
+    for master_id in range(1, masters + 1):
+        for servant_id in rng.sample(range(1, servants + 1), min(per_master, servants)):
+            status = CONTRACT_TERMINATED if servant_id in active else CONTRACT_ACTIVE
+            active.add(servant_id)
+            began = start + timedelta(hours=rng.randint(0, 20_000))
+            yield {
+                "master_id": master_id,
+                "servant_id": servant_id,
+                "status": status,
+                "start_date": began,
+                "end_date": began + timedelta(days=rng.randint(1, 400)),
+                "command_spells": rng.randint(0, 3),
+            }
+
+
+def skill_rows(rng: random.Random, count: int):
+    for id in range(1, count + 1):
+        yield {
+            "id": id,
+            "skill_type": rng.choice(["active", "passive", "append"]),
+            "rank": rng.choice(["EX", "A", "B", "C"]),
+            "name": fake_name(rng),
+            "description": " ".join(fake_name(rng) for _ in range(15)),
+            "icon": "",
+        }
+
+
+def servant_skill_rows(rng: random.Random, servants: int, skills: int, per_servant):
+    for servant_id in range(1, servants + 1):
+        for skill_id in rng.sample(range(1, skills + 1), min(per_servant, skills)):
+            yield {"servant_id": servant_id, "skill_id": skill_id}
+
+
+def noble_phantasm_rows(rng: random.Random, servants: int):
+    for servant_id in range(1, servants + 1):
+        yield {
+            "servant_id": servant_id,
+            "rank": rng.choice(["EX", "A++", "A", "B"]),
+            "activation_type": rng.choice(["anti-unit", "anti-army", "support"]),
+            "name": fake_name(rng),
+            "description": " ".join(fake_name(rng) for _ in range(30)),
+        }
+
+
+def alias_rows(rng: random.Random, servants: int):
+    for servant_id in range(1, servants + 1):
+        yield {
+            "id": servant_id,
+            "servant_id": servant_id,
+            "language_code": rng.choice(LANGUAGES),
+            "name": fake_name(rng),
+        }
+
+
+def write_picture(rng: random.Random) -> str:
+    from PIL import Image
+
+    from app.media import build_derivatives
+    from app.utils import object_path
+
+    buffer = io.BytesIO()
+    color = tuple(rng.randint(0, 255) for _ in range(3))
+    Image.new("RGB", (512, 512), color).save(buffer, "PNG")
+    data = buffer.getvalue()
+    path = object_path(hashlib.sha256(data).hexdigest(), ".png")
+    os.makedirs(path.parent, exist_ok=True)
+    path.write_bytes(data)
+    build_derivatives(str(path))
+    return str(path)
+
+
+def picture_rows(rng: random.Random, count: int):
+    for servant_id in range(1, count + 1):
+        yield {"servant_id": servant_id, "grade": 1, "picture": write_picture(rng)}
+
+
+async def insert_chunks(conn, model, rows) -> int:
+    # rows use attribute names; a core insert wants column keys ("class", "type")
+    columns = {attr.key: attr.columns[0].key for attr in model.__mapper__.column_attrs}
+    total = 0
+    chunk = []
+    for row in rows:
+        chunk.append({columns[key]: value for key, value in row.items()})
+        if len(chunk) == CHUNK_SIZE:
+            await conn.execute(insert(model), chunk)
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        await conn.execute(insert(model), chunk)
+        total += len(chunk)
+    return total
+
+
+async def sync_sequences(conn):
+    for table in ("servant", "master", "skill", "servant_localization", "alias"):
+        await conn.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 1))"
+            )
+        )
+
+
+async def seed(scale: float = 1.0, seed: int = 42, create_schema: bool = False) -> dict:
+    from app.crud import AnalyticsService
+    from app.database import Base, SessionLocal, engine
+    from app.models import (
+        Alias,
+        Contract,
+        Master,
+        NoblePhantasm,
+        Servant,
+        ServantLocalization,
+        ServantPicture,
+        ServantSkill,
+        Skill,
+    )
+
+    rng = random.Random(seed)
+    sizes = volumes(scale)
+    started = time.perf_counter()
+    async with engine.begin() as conn:
+        if create_schema:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        elif (await conn.execute(select(func.count()).select_from(Servant))).scalar():
+            raise SystemExit("database already has servants; use an empty database")
+        counts = {
+            "servants": await insert_chunks(
+                conn, Servant, servant_rows(rng, sizes["servants"])
+            ),
+            "localizations": await insert_chunks(
+                conn, ServantLocalization, localization_rows(rng, sizes["servants"])
+            ),
+            "masters": await insert_chunks(
+                conn, Master, master_rows(rng, sizes["masters"])
+            ),
+            "contracts": await insert_chunks(
+                conn,
+                Contract,
+                contract_rows(
+                    rng,
+                    sizes["masters"],
+                    sizes["servants"],
+                    sizes["contracts_per_master"],
+                ),
+            ),
+            "skills": await insert_chunks(
+                conn, Skill, skill_rows(rng, sizes["skills"])
+            ),
+            "servant_skills": await insert_chunks(
+                conn,
+                ServantSkill,
+                servant_skill_rows(
+                    rng, sizes["servants"], sizes["skills"], sizes["skills_per_servant"]
+                ),
+            ),
+            "noble_phantasms": await insert_chunks(
+                conn, NoblePhantasm, noble_phantasm_rows(rng, sizes["servants"])
+            ),
+            "aliases": await insert_chunks(
+                conn, Alias, alias_rows(rng, sizes["servants"])
+            ),
+            "pictures": await insert_chunks(
+                conn,
+                ServantPicture,
+                picture_rows(rng, min(sizes["pictures"], sizes["servants"])),
+            ),
+        }
+        if engine.dialect.name == "postgresql":
+            await sync_sequences(conn)
+    async with SessionLocal() as session:
+        await AnalyticsService(session).rebuild()
+        await session.commit()
+    if engine.dialect.name == "postgresql":
+        async with engine.begin() as conn:
+            await conn.execute(text("ANALYZE"))
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fill an empty database with bench data"
+    )
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--create-schema",
+        action="store_true",
+        help="drop and create all tables from the models (SQLite stand-in only; "
+        "without the migration triggers GET /sync answers 503)",
+    )
+    args = parser.parse_args()
+
+    async def run():
+        from app.database import engine
+
+        try:
+            print(await seed(args.scale, args.seed, args.create_schema))
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import shutil
+
+# Read by gunicorn from the working directory. Workers share metrics through
+# files in PROMETHEUS_MULTIPROC_DIR, see app/metrics.py.
+
+
+def on_starting(server):
+    # samples left over from a previous run would be summed into this one
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,64 @@
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.database import DATABASE_URL, Base
+from app import models  # noqa: F401  registers the tables on Base.metadata
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+# created by migrations only: expression / GIN indexes the models cannot declare
+# portably, and SQLite would reject
+UNMANAGED_INDEXES = {
+    "ix_servant_name_trgm",
+    "ix_servant_name_fts",
+    "ix_alias_name_trgm",
+    "ix_alias_name_fts",
+    "ix_servant_localization_name_trgm",
+    "ix_servant_localization_fts",
+}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (type_ == "index" and name in UNMANAGED_INDEXES)
+
+
+def run_migrations_offline():
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        include_object=include_object,
+        literal_binds=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_migrations_online():
+    engine = create_async_engine(DATABASE_URL, poolclass=NullPool)
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    asyncio.run(run_migrations_online())
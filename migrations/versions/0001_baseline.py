@@ -0,0 +1,159 @@
+"""baseline: the schema as it stood before migrations
+
+The tables of the original deployment with their server defaults, the
+unique nickname and positive level rules on master, and the trigger that
+keeps a servant to one active contract. Existing databases already have all
+of it; mark them with `alembic stamp 0001` and `alembic upgrade head` adds
+everything after it.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# a servant has at most one active contract; ContractService maps the
+# PostgreSQL exception (SQLSTATE P0001) to a 400
+POSTGRES_CONTRACT_TRIGGER = [
+    """
+    CREATE FUNCTION contract_single_active() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF NEW.status = 'active' AND EXISTS (
+            SELECT 1 FROM contract
+            WHERE servant_id = NEW.servant_id
+              AND master_id <> NEW.master_id
+              AND status = 'active'
+        ) THEN
+            RAISE EXCEPTION 'Servant % already has an active contract', NEW.servant_id;
+        END IF;
+        RETURN NEW;
+    END $$
+    """,
+    "CREATE TRIGGER contract_single_active BEFORE INSERT OR UPDATE ON contract "
+    "FOR EACH ROW EXECUTE FUNCTION contract_single_active()",
+]
+SQLITE_CONTRACT_TRIGGERS = [
+    f"CREATE TRIGGER contract_single_active_{event.lower()} BEFORE {event} ON contract "
+    "WHEN NEW.status = 'active' AND EXISTS ("
+    "SELECT 1 FROM contract WHERE servant_id = NEW.servant_id "
+    "AND master_id <> NEW.master_id AND status = 'active') "
+    "BEGIN SELECT RAISE(ABORT, 'Servant already has an active contract'); END"
+    for event in ("INSERT", "UPDATE")
+]
+
+
+def upgrade():
+    op.create_table(
+        "master",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("nickname", sa.String, nullable=False, unique=True),
+        sa.Column("level", sa.Integer, nullable=False, server_default="1"),
+        sa.Column(
+            "date_registered",
+            sa.DateTime,
+            nullable=False,
+            server_default=sa.func.current_timestamp(),
+        ),
+        sa.Column("display_name", sa.String),
+        sa.CheckConstraint("level > 0", name="master_level_check"),
+    )
+    op.create_table(
+        "servant",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("class", sa.String, nullable=False),
+        sa.Column("name", sa.String, nullable=False),
+        sa.Column("ascension_level", sa.Integer, server_default="0"),
+        sa.Column("level", sa.Integer, server_default="1"),
+        sa.Column("state", sa.String, server_default="available"),
+        sa.Column("alignment", sa.String),
+        sa.Column("gender", sa.String),
+    )
+    op.create_table(
+        "skill",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("type", sa.String),
+        sa.Column("rank", sa.String),
+        sa.Column("name", sa.String),
+        sa.Column("description", sa.Text),
+        sa.Column("icon", sa.String),
+    )
+    op.create_table(
+        "servant_picture",
+        sa.Column("servant_id", sa.Integer, sa.ForeignKey("servant.id"), primary_key=True),
+        sa.Column("grade", sa.Integer, primary_key=True),
+        sa.Column("picture", sa.String),
+    )
+    op.create_table(
+        "alias",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("language_code", sa.String, nullable=False),
+        sa.Column("name", sa.String, nullable=False),
+        sa.Column("servant_id", sa.Integer, sa.ForeignKey("servant.id"), nullable=False),
+    )
+    op.create_table(
+        "noble_phantasm",
+        sa.Column("servant_id", sa.Integer, sa.ForeignKey("servant.id"), primary_key=True),
+        sa.Column("rank", sa.String),
+        sa.Column("type", sa.String),
+        sa.Column("name", sa.String),
+        sa.Column("description", sa.Text),
+    )
+    op.create_table(
+        "contract",
+        sa.Column("master_id", sa.Integer, sa.ForeignKey("master.id"), primary_key=True),
+        sa.Column("servant_id", sa.Integer, sa.ForeignKey("servant.id"), primary_key=True),
+        sa.Column("status", sa.String, server_default="active"),
+        sa.Column("start_date", sa.DateTime, server_default=sa.func.current_timestamp()),
+        sa.Column("end_date", sa.DateTime),
+        sa.Column("command_spells", sa.Integer, server_default="3"),
+    )
+    op.create_table(
+        "servant_localization",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("language", sa.String, nullable=False),
+        sa.Column("name", sa.String),
+        sa.Column("description", sa.Text),
+        sa.Column("history", sa.Text),
+        sa.Column("prototype_person", sa.Text),
+        sa.Column("illustrator", sa.Text),
+        sa.Column("voice_actor", sa.Text),
+        sa.Column("temper", sa.Text),
+        sa.Column("intro", sa.Text),
+        sa.Column("servant_id", sa.Integer, sa.ForeignKey("servant.id"), nullable=False),
+    )
+    op.create_table(
+        "servant_skill",
+        sa.Column("servant_id", sa.Integer, sa.ForeignKey("servant.id"), primary_key=True),
+        sa.Column("skill_id", sa.Integer, sa.ForeignKey("skill.id"), primary_key=True),
+    )
+    if op.get_bind().dialect.name == "postgresql":
+        for statement in POSTGRES_CONTRACT_TRIGGER:
+            op.execute(statement)
+    else:
+        for statement in SQLITE_CONTRACT_TRIGGERS:
+            op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP TRIGGER contract_single_active ON contract")
+        op.execute("DROP FUNCTION contract_single_active()")
+    for table in (
+        "servant_skill",
+        "servant_localization",
+        "contract",
+        "noble_phantasm",
+        "alias",
+        "servant_picture",
+        "skill",
+        "servant",
+        "master",
+    ):
+        op.drop_table(table)
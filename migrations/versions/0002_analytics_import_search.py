@@ -0,0 +1,99 @@
+"""summary tables, the import conflict target and the search indexes
+
+- class_level_summary and master_top_servant behind /level_analys and
+  /top_servants, as in app/queries/analytics.sql
+- the unique servant_localization (servant_id, language) index that the
+  upserts of POST /import name as their conflict target, as in
+  app/queries/bulk_import.sql
+- on PostgreSQL, pg_trgm and the GIN indexes behind GET /search, as in
+  app/queries/search.sql
+
+A database stamped at 0001 may already have run those scripts by hand, so
+every object is created only if it is missing.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+LOCALIZATION_INDEX = "uq_servant_localization_servant_language"
+# the tsvector expressions must match the ones built in SearchService.search
+# exactly, or the planner will not use them
+SEARCH_INDEXES = [
+    ("ix_servant_name_trgm", "servant USING gin (name gin_trgm_ops)"),
+    ("ix_servant_name_fts", "servant USING gin (to_tsvector('simple', name))"),
+    ("ix_alias_name_trgm", "alias USING gin (name gin_trgm_ops)"),
+    ("ix_alias_name_fts", "alias USING gin (to_tsvector('simple', name))"),
+    (
+        "ix_servant_localization_name_trgm",
+        "servant_localization USING gin (name gin_trgm_ops)",
+    ),
+    (
+        "ix_servant_localization_fts",
+        "servant_localization USING gin "
+        "(to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, '')))",
+    ),
+]
+
+
+def upgrade():
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if "class_level_summary" not in tables:
+        op.create_table(
+            "class_level_summary",
+            sa.Column("class", sa.String, primary_key=True),
+            sa.Column("servant_count", sa.Integer, nullable=False),
+            sa.Column("max_level", sa.Integer),
+            sa.Column("min_level", sa.Integer),
+            sa.Column("avg_level", sa.Float),
+        )
+    if "master_top_servant" not in tables:
+        op.create_table(
+            "master_top_servant",
+            sa.Column(
+                "master_id",
+                sa.Integer,
+                sa.ForeignKey("master.id", ondelete="CASCADE"),
+                primary_key=True,
+            ),
+            sa.Column("rank", sa.Integer, primary_key=True),
+            sa.Column(
+                "servant_id",
+                sa.Integer,
+                sa.ForeignKey("servant.id", ondelete="CASCADE"),
+                nullable=False,
+            ),
+            sa.Column("servant_level", sa.Integer),
+        )
+    # fails if a servant already has two rows for one language; merge those
+    # first
+    op.create_index(
+        LOCALIZATION_INDEX,
+        "servant_localization",
+        ["servant_id", "language"],
+        unique=True,
+        if_not_exists=True,
+    )
+
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, definition in SEARCH_INDEXES:
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        for name, _ in SEARCH_INDEXES:
+            op.execute(f"DROP INDEX {name}")
+    op.drop_index(LOCALIZATION_INDEX, table_name="servant_localization")
+    op.drop_table("master_top_servant")
+    op.drop_table("class_level_summary")
@@ -0,0 +1,79 @@
+"""indexes for the hot query shapes
+
+- contract (master_id, status): active contract counts per master
+- contract (servant_id, master_id): AnalyticsService.masters_of, and the
+  contract side of servant deletes
+- servant (class, level): class_level_summary refreshes read only the index
+- alias (servant_id, language_code): GET /servant/{id}/aliases
+- servant_skill (skill_id): skill deletes and skill -> servant lookups
+- servant_localization (servant_id, language) INCLUDE (name): the existing
+  unique index, made covering for /top_servants and the name joins
+
+On PostgreSQL the indexes are built CONCURRENTLY, so the upgrade does not
+block writes on a live database.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_contract_master_status", "contract", ["master_id", "status"]),
+    ("ix_contract_servant_master", "contract", ["servant_id", "master_id"]),
+    ("ix_servant_class_level", "servant", ["class", "level"]),
+    ("ix_alias_servant_language", "alias", ["servant_id", "language_code"]),
+    ("ix_servant_skill_skill", "servant_skill", ["skill_id"]),
+]
+LOCALIZATION_INDEX = "uq_servant_localization_servant_language"
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns)
+        return
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+        # swap in the covering version; one of the two always exists, so
+        # upserts keep their conflict target
+        op.execute(
+            f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {LOCALIZATION_INDEX}_new "
+            "ON servant_localization (servant_id, language) INCLUDE (name)"
+        )
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {LOCALIZATION_INDEX}")
+        op.execute(
+            f"ALTER INDEX {LOCALIZATION_INDEX}_new RENAME TO {LOCALIZATION_INDEX}"
+        )
+    op.execute("ANALYZE contract, servant, alias, servant_skill, servant_localization")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table)
+        return
+    with op.get_context().autocommit_block():
+        op.execute(
+            f"CREATE UNIQUE INDEX CONCURRENTLY {LOCALIZATION_INDEX}_old "
+            "ON servant_localization (servant_id, language)"
+        )
+        op.execute(f"DROP INDEX CONCURRENTLY {LOCALIZATION_INDEX}")
+        op.execute(
+            f"ALTER INDEX {LOCALIZATION_INDEX}_old RENAME TO {LOCALIZATION_INDEX}"
+        )
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,192 @@
+"""row versions and tombstones for GET /sync
+
+Every insert or update of a tracked catalog row stamps it with the next
+value of one counter shared by all of them, and every delete writes a
+sync_tombstone row with the next value instead. A client that remembers the
+highest version it has seen asks for the rows above it.
+
+On PostgreSQL the counter is a sequence, and the triggers take a
+transaction-level advisory lock before drawing from it, so catalog writers
+commit in version order and a reader never sees version n + 1 without n.
+Catalog writes are rare content patches, so serializing them is cheap.
+SQLite keeps the counter in a one-row table.
+
+Existing rows are stamped once by a no-op UPDATE through the new triggers,
+so every row has its own version and /sync can page on it.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+# table, entity name in sync_tombstone, primary key columns
+TRACKED = [
+    ("servant", "servant", ["id"]),
+    ("servant_localization", "localization", ["id"]),
+    ("skill", "skill", ["id"]),
+    ("noble_phantasm", "noble_phantasm", ["servant_id"]),
+    ("servant_picture", "picture", ["servant_id", "grade"]),
+]
+SEQUENCE = "sync_version_seq"
+
+POSTGRES_FUNCTIONS = [
+    f"""
+    CREATE FUNCTION sync_row_version() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('{SEQUENCE}'));
+        NEW.row_version := nextval('{SEQUENCE}');
+        RETURN NEW;
+    END $$
+    """,
+    f"""
+    CREATE FUNCTION sync_tombstone() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('{SEQUENCE}'));
+        INSERT INTO sync_tombstone (row_version, entity, entity_key)
+        SELECT nextval('{SEQUENCE}'), TG_ARGV[0], jsonb_object_agg(key, value)::text
+        FROM jsonb_each(to_jsonb(OLD))
+        WHERE key = ANY (TG_ARGV[1:]);
+        RETURN OLD;
+    END $$
+    """,
+    # a servant's skill ids are part of its sync payload
+    """
+    CREATE FUNCTION sync_touch_servant() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE servant SET row_version = row_version
+        WHERE id = CASE WHEN TG_OP = 'DELETE' THEN OLD.servant_id ELSE NEW.servant_id END;
+        RETURN NULL;
+    END $$
+    """,
+]
+
+
+def postgres_triggers():
+    for table, entity, key in TRACKED:
+        arguments = ", ".join(f"'{value}'" for value in [entity, *key])
+        yield (
+            f"CREATE TRIGGER {table}_row_version BEFORE INSERT OR UPDATE ON {table} "
+            "FOR EACH ROW EXECUTE FUNCTION sync_row_version()"
+        )
+        yield (
+            f"CREATE TRIGGER {table}_tombstone AFTER DELETE ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION sync_tombstone({arguments})"
+        )
+    yield (
+        "CREATE TRIGGER servant_skill_touch_servant "
+        "AFTER INSERT OR UPDATE OR DELETE ON servant_skill "
+        "FOR EACH ROW EXECUTE FUNCTION sync_touch_servant()"
+    )
+
+
+def sqlite_triggers():
+    # an UPDATE inside a trigger does not fire the same trigger again while
+    # recursive_triggers is off, which is the default; the WHEN keeps the
+    # insert trigger's own stamp from firing the update trigger
+    stamp = (
+        "UPDATE sync_version SET value = value + 1; "
+        "UPDATE {table} SET row_version = (SELECT value FROM sync_version) "
+        "WHERE rowid = NEW.rowid;"
+    )
+    for table, entity, key in TRACKED:
+        yield (
+            f"CREATE TRIGGER {table}_row_version_insert AFTER INSERT ON {table} "
+            f"BEGIN {stamp.format(table=table)} END"
+        )
+        yield (
+            f"CREATE TRIGGER {table}_row_version_update AFTER UPDATE ON {table} "
+            "WHEN NEW.row_version = OLD.row_version "
+            f"BEGIN {stamp.format(table=table)} END"
+        )
+        fields = ", ".join(f"'{column}', OLD.{column}" for column in key)
+        yield (
+            f"CREATE TRIGGER {table}_tombstone AFTER DELETE ON {table} BEGIN "
+            "UPDATE sync_version SET value = value + 1; "
+            "INSERT INTO sync_tombstone (row_version, entity, entity_key) "
+            f"VALUES ((SELECT value FROM sync_version), '{entity}', json_object({fields})); "
+            "END"
+        )
+    for event, row in (("INSERT", "NEW"), ("DELETE", "OLD")):
+        yield (
+            f"CREATE TRIGGER servant_skill_touch_servant_{event.lower()} "
+            f"AFTER {event} ON servant_skill BEGIN "
+            f"UPDATE servant SET row_version = row_version WHERE id = {row}.servant_id; END"
+        )
+
+
+def backfill():
+    for table, _, _ in TRACKED:
+        op.execute(f"UPDATE {table} SET row_version = row_version")
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == "postgresql"
+    op.create_table(
+        "sync_tombstone",
+        sa.Column("row_version", sa.BigInteger, primary_key=True, autoincrement=False),
+        sa.Column("entity", sa.String, nullable=False),
+        sa.Column("entity_key", sa.String, nullable=False),
+    )
+    for table, _, _ in TRACKED:
+        # a constant default, so PostgreSQL adds the column without a rewrite
+        op.add_column(
+            table,
+            sa.Column("row_version", sa.BigInteger, nullable=False, server_default="0"),
+        )
+    if postgres:
+        op.execute(f"CREATE SEQUENCE {SEQUENCE}")
+        for function in POSTGRES_FUNCTIONS:
+            op.execute(function)
+        for trigger in postgres_triggers():
+            op.execute(trigger)
+        backfill()
+        with op.get_context().autocommit_block():
+            for table, _, _ in TRACKED:
+                op.create_index(
+                    f"ix_{table}_row_version",
+                    table,
+                    ["row_version"],
+                    postgresql_concurrently=True,
+                    if_not_exists=True,
+                )
+        return
+    op.execute("CREATE TABLE sync_version (value INTEGER NOT NULL)")
+    op.execute("INSERT INTO sync_version (value) VALUES (0)")
+    for trigger in sqlite_triggers():
+        op.execute(trigger)
+    backfill()
+    for table, _, _ in TRACKED:
+        op.create_index(f"ix_{table}_row_version", table, ["row_version"])
+
+
+def downgrade():
+    postgres = op.get_bind().dialect.name == "postgresql"
+    if postgres:
+        for table, _, _ in TRACKED:
+            op.execute(f"DROP TRIGGER {table}_row_version ON {table}")
+            op.execute(f"DROP TRIGGER {table}_tombstone ON {table}")
+        op.execute("DROP TRIGGER servant_skill_touch_servant ON servant_skill")
+        for function in ("sync_row_version", "sync_tombstone", "sync_touch_servant"):
+            op.execute(f"DROP FUNCTION {function}()")
+        op.execute(f"DROP SEQUENCE {SEQUENCE}")
+    else:
+        for table, _, _ in TRACKED:
+            op.execute(f"DROP TRIGGER {table}_row_version_insert")
+            op.execute(f"DROP TRIGGER {table}_row_version_update")
+            op.execute(f"DROP TRIGGER {table}_tombstone")
+        op.execute("DROP TRIGGER servant_skill_touch_servant_insert")
+        op.execute("DROP TRIGGER servant_skill_touch_servant_delete")
+        op.execute("DROP TABLE sync_version")
+    for table, _, _ in TRACKED:
+        op.drop_index(f"ix_{table}_row_version", table_name=table)
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column("row_version")
+    op.drop_table("sync_tombstone")
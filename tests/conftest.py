@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# app.database builds its engine at import time
+os.environ.setdefault(
+    "DATABASE_URL",
+    f"sqlite+aiosqlite:///{tempfile.gettempdir()}/fgp-tests.sqlite3",
+)
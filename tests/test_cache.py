@@ -0,0 +1,73 @@
+import pytest
+
+from app.cache import MISSING, CacheBackend, MemoryBackend, SQLiteBackend
+
+
+def backend(path, sync_interval: float = 0) -> SQLiteBackend:
+    return SQLiteBackend(str(path), MemoryBackend(16, {}, 60), sync_interval)
+
+
+@pytest.fixture
+def workers(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    return backend(path), backend(path)
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        CacheBackend()
+
+
+def test_invalidation_reaches_other_worker(workers):
+    first, second = workers
+    first.set(("skills", 1), "cached")
+    second.set(("skills", 1), "cached")
+
+    second.invalidate("skills", 1)
+
+    assert first.get(("skills", 1)) is MISSING
+    assert first.generation("skills") == second.generation("skills") == 1
+    assert (first.applied, second.published) == (1, 1)
+
+
+def test_invalidation_is_scoped_to_prefix(workers):
+    first, second = workers
+    first.set(("localization", 1, "en"), "one")
+    first.set(("localization", 2, "en"), "two")
+
+    second.invalidate("localization", 1)
+
+    assert first.get(("localization", 1, "en")) is MISSING
+    assert first.get(("localization", 2, "en")) == "two"
+
+
+def test_own_invalidation_is_not_replayed(workers):
+    first, _ = workers
+    first.invalidate("np")
+    first.get(("np", 1))
+
+    assert first.generation("np") == 1
+    assert first.applied == 0
+
+
+def test_sync_interval_defers_reads_of_the_log(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    first, second = backend(path, sync_interval=60), backend(path)
+    first.set(("skills", 1), "cached")
+
+    second.invalidate("skills")
+
+    assert first.get(("skills", 1)) == "cached"
+    first._synced_at -= 60
+    assert first.get(("skills", 1)) is MISSING
+
+
+def test_pruned_log_clears_local_cache(workers):
+    first, second = workers
+    first.set(("servant_list",), "cached")
+    second.conn.execute("INSERT INTO invalidation (id, prefix) VALUES (5, '[\"np\"]')")
+
+    first.sync()
+
+    assert first.get(("servant_list",)) is MISSING
+    assert first.generation("servant_list") == 1
@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+from app.crud import ChangeTrackingMissing, SyncService, SyncTokenAhead
+from app.database import Base, SessionLocal, engine
+from app.instrumentation import query_budget
+from app.models import Servant, Skill, SyncTombstone
+from app.utils import decode_cursor, encode_cursor
+
+# versions are unique across tables, as the 0004 triggers hand them out
+SERVANT_VERSIONS = (1, 3, 5, 7, 9)
+SKILL_VERSIONS = (2, 4, 6)
+TOMBSTONE_VERSIONS = (8, 10)
+
+
+async def create_catalog():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        for index, version in enumerate(SERVANT_VERSIONS, 1):
+            db.add(
+                Servant(
+                    id=index,
+                    name=f"Servant {index}",
+                    class_name="saber",
+                    ascension_level=0,
+                    level=1,
+                    state="available",
+                    alignment="neutral",
+                    gender="female",
+                    row_version=version,
+                )
+            )
+        for index, version in enumerate(SKILL_VERSIONS, 1):
+            db.add(
+                Skill(
+                    id=index,
+                    skill_type="active",
+                    rank="A",
+                    name=f"Skill {index}",
+                    description="",
+                    icon="",
+                    row_version=version,
+                )
+            )
+        for version in TOMBSTONE_VERSIONS:
+            db.add(
+                SyncTombstone(
+                    row_version=version, entity="skill", entity_key=f'{{"id": {version}}}'
+                )
+            )
+        await db.commit()
+
+
+async def changes(since: int | None, limit: int):
+    async with SessionLocal() as db:
+        token = None if since is None else encode_cursor({"version": since})
+        return await SyncService(db).changes(token, limit)
+
+
+def run(coroutine):
+    # pooled connections belong to the loop that opened them
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+def versions(page, name: str) -> list[int]:
+    return [row.id for row in getattr(page, name)]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def catalog():
+    run(create_catalog())
+    # create_all has no triggers; the rows above carry their versions
+    SyncService.tracking_installed = True
+    yield
+    SyncService.tracking_installed = False
+
+
+def test_full_page_cuts_every_list_at_the_same_version():
+    page = run(changes(None, 2))
+    # servants 1, 3 fill the page; skills are cut at 3 too, not at their own 4
+    assert decode_cursor(page.token) == {"version": 3}
+    assert page.has_more
+    assert versions(page, "servants") == [1, 2]
+    assert versions(page, "skills") == [1]
+    # a client without a token has nothing to delete
+    assert page.deleted == []
+
+
+def test_pages_resume_from_the_token():
+    page = run(changes(3, 2))
+    assert decode_cursor(page.token) == {"version": 7}
+    assert page.has_more
+    assert versions(page, "servants") == [3, 4]
+    assert versions(page, "skills") == [2, 3]
+    # tombstone 8 lies above the cut
+    assert page.deleted == []
+
+
+def test_last_page_reaches_the_latest_version():
+    page = run(changes(7, 2))
+    assert decode_cursor(page.token) == {"version": 10}
+    assert not page.has_more
+    assert versions(page, "servants") == [5]
+    assert versions(page, "skills") == []
+    assert [deletion.key for deletion in page.deleted] == [{"id": 8}, {"id": 10}]
+
+
+def test_up_to_date_client_costs_one_query():
+    with query_budget(1):
+        page = run(changes(10, 2))
+    assert decode_cursor(page.token) == {"version": 10}
+    assert not page.has_more
+    assert page.servants == page.skills == page.deleted == []
+
+
+def test_token_ahead_of_the_catalog_forces_a_resync():
+    # e.g. the database was restored from a backup older than the client
+    with pytest.raises(SyncTokenAhead):
+        run(changes(11, 2))
+
+
+@pytest.mark.parametrize("position", [{"version": True}, {"version": "1"}, {}])
+def test_invalid_token(position):
+    async def request():
+        async with SessionLocal() as db:
+            await SyncService(db).changes(encode_cursor(position))
+
+    with pytest.raises(ValueError, match="Invalid sync token"):
+        run(request())
+
+
+def test_missing_triggers_fail_loudly():
+    SyncService.tracking_installed = False
+    try:
+        with pytest.raises(ChangeTrackingMissing):
+            run(changes(None, 2))
+    finally:
+        SyncService.tracking_installed = True